@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AIClient:
+    """Один долгоживущий асинхронный клиент GigaChat на весь бот.
+
+    Токен доступа и HTTP-соединения переиспользуются между запросами,
+    а семафор ограничивает число одновременных обращений к модели —
+    лишние запросы ждут своей очереди, не блокируя event loop.
+    """
+
+    def __init__(self, credentials, model="GigaChat", max_concurrency=4, timeout=60.0, max_connections=None,
+                 base_url=None, auth_url=None):
+        self.credentials = credentials
+        self.model = model
+        # Другие адреса API нужны только нагрузочным тестам с заглушкой GigaChat
+        self.urls = {k: v for k, v in (("base_url", base_url), ("auth_url", auth_url)) if v}
+        self.timeout = timeout
+        self.max_connections = max_connections or max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._giga = None
+
+    @property
+    def giga(self):
+        if self._giga is None:
+            # Библиотека тяжёлая (httpx, pydantic-модели): импортируем при первом обращении, а не при старте бота
+            from gigachat import GigaChat
+
+            self._giga = GigaChat(
+                credentials=self.credentials,
+                model=self.model,
+                verify_ssl_certs=False,
+                timeout=self.timeout,
+                max_connections=self.max_connections,
+                **self.urls,
+            )
+        return self._giga
+
+    async def prefetch_token(self):
+        """Получает токен доступа заранее, чтобы первый вопрос не ждал авторизации."""
+        if not self.credentials:
+            return
+        try:
+            await self.giga.aget_token()
+        except Exception as e:
+            logger.warning("Не удалось заранее получить токен GigaChat: %s", e)
+
+    @property
+    def waiting(self):
+        # Сколько запросов сейчас стоит в очереди за семафором
+        waiters = getattr(self._semaphore, "_waiters", None)
+        return len(waiters) if waiters else 0
+
+    async def chat(self, messages):
+        payload = {"messages": messages}
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                response = await self.giga.achat(payload)
+            except Exception:
+                metrics.ai_errors.inc()
+                raise
+            metrics.ai_request_seconds.observe(time.perf_counter() - started, mode="chat")
+        self._count_usage(response.usage)
+        return response.choices[0].message.content
+
+    async def stream(self, messages):
+        """Ответ модели по кусочкам, по мере генерации."""
+        payload = {"messages": messages}
+        async with self._semaphore:
+            started = time.perf_counter()
+            first = True
+            usage = None
+            try:
+                async for chunk in self.giga.astream(payload):
+                    usage = chunk.usage or usage
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        if first:
+                            metrics.ai_first_token_seconds.observe(time.perf_counter() - started)
+                            first = False
+                        yield delta
+            except Exception:
+                metrics.ai_errors.inc()
+                raise
+            metrics.ai_request_seconds.observe(time.perf_counter() - started, mode="stream")
+        self._count_usage(usage)
+
+    @staticmethod
+    def _count_usage(usage):
+        if usage is not None:
+            metrics.ai_tokens.inc(usage.prompt_tokens, kind="prompt")
+            metrics.ai_tokens.inc(usage.completion_tokens, kind="completion")
+
+    async def close(self):
+        if self._giga is not None:
+            await self._giga.aclose()
+            self._giga = None
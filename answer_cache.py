@@ -0,0 +1,128 @@
+import time
+from collections import OrderedDict
+
+from retrieval import STOP_WORDS, stem, tokenize
+
+# Для поиска по базе знаний вопросительные слова, отрицание и время — шум, а для ключа ответа — смысл:
+# «где будет субботник?» и «когда будет субботник?», «что было?» и «что будет?» — разные вопросы
+MEANINGFUL_WORDS = frozenset("""
+что как когда где кто куда зачем почему откуда сколько какой какая чем чего кого не нет ни нельзя можно надо
+разве ли без больше быть был была было были будет будут будем
+""".split())
+CACHE_STOP_WORDS = STOP_WORDS - MEANINGFUL_WORDS
+MEANINGFUL_STEMS = frozenset(stem(w) for w in MEANINGFUL_WORDS)
+
+
+def normalize(question):
+    """Ключ вопроса: регистр, пунктуация, стоп-слова и окончания не важны, порядок слов тоже."""
+    return " ".join(sorted(set(tokenize(question or "", CACHE_STOP_WORDS))))
+
+
+class AnswerCache:
+    """Готовые ответы нейросети на частые вопросы.
+
+    Ключ — нормализованный вопрос. Если включён fuzzy, вопрос без точного
+    совпадения сравнивается с уже отвеченными по доле общих слов (Jaccard);
+    похожими считаются только вопросы с теми же вопросительными словами,
+    отрицанием и временем — отличаться могут лишь слова по существу.
+    Размер ограничен (LRU), записи живут ttl секунд. Любое изменение
+    мероприятий (новая версия EventsRepository) очищает кэш целиком.
+    Вопросы, от которых в ключе осталось меньше min_terms слов («а это?»,
+    «субботник»), слишком размыты: их ответы не кэшируются.
+    """
+
+    def __init__(self, max_size=500, ttl=3600, fuzzy=True, threshold=0.8, min_terms=2):
+        self.max_size = max_size
+        self.min_terms = min_terms
+        self.ttl = ttl
+        self.fuzzy = fuzzy
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # key -> (answer, created_at)
+        self._by_term = {}  # term -> {key, ...}, для поиска похожих вопросов
+        self._version = None
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._items), "hit_rate": self.hit_rate}
+
+    def check_version(self, version):
+        if version != self._version:
+            self.clear()
+            self._version = version
+
+    def clear(self):
+        self._items.clear()
+        self._by_term.clear()
+
+    def _key(self, question):
+        key = normalize(question)
+        return key if len(key.split()) >= self.min_terms else ""
+
+    def get(self, question):
+        key = self._key(question)
+        if not key:
+            self.misses += 1
+            return None
+        found = self._lookup(key)
+        if found is None and self.fuzzy:
+            found = self._lookup(self._similar(key))
+        if found is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return found
+
+    def put(self, question, answer):
+        key = self._key(question)
+        if not key or not answer:
+            return
+        if key in self._items:
+            self._items.move_to_end(key)
+        else:
+            for term in key.split():
+                self._by_term.setdefault(term, set()).add(key)
+        self._items[key] = (answer, time.monotonic())
+        while len(self._items) > self.max_size:
+            self._drop(next(iter(self._items)))
+
+    def _lookup(self, key):
+        item = self._items.get(key) if key else None
+        if item is None:
+            return None
+        if time.monotonic() - item[1] > self.ttl:
+            self._drop(key)
+            return None
+        self._items.move_to_end(key)
+        return item[0]
+
+    def _similar(self, key):
+        terms = set(key.split())
+        meaning = terms & MEANINGFUL_STEMS
+        candidates = set()
+        for term in terms:
+            candidates |= self._by_term.get(term, set())
+        best, best_score = None, self.threshold
+        for candidate in candidates:
+            other = set(candidate.split())
+            # «без формы» и «в форме» почти совпадают по словам, но ответы у них противоположные
+            if other & MEANINGFUL_STEMS != meaning:
+                continue
+            score = len(terms & other) / len(terms | other)
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def _drop(self, key):
+        self._items.pop(key, None)
+        for term in key.split():
+            keys = self._by_term.get(term)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_term[term]
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+STALE_CALLBACK = "⏳ Бот перезапускался. Нажми кнопку ещё раз, пожалуйста."
+
+
+def chat_key(update):
+    """Чат апдейта; апдейты одного чата разбираются строго по очереди."""
+    event = update.event
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return ("user", user.id) if user is not None else ("update", update.update_id)
+
+
+class BacklogDrainer:
+    """Разбор апдейтов, накопившихся в Telegram, пока бот был выключен.
+
+    Вместо drop_pending_updates очередь вычитывается через getUpdates и
+    раздаётся workers обработчикам: разные чаты идут параллельно, апдейты
+    одного чата — по порядку, так что анкета, заполненная во время
+    деплоя, не перепутается. Чтобы ответы не упёрлись в лимит Telegram
+    на чат (~1 сообщение в секунду), апдейты чата идут не чаще раза в
+    chat_interval секунд, а пока чат ждёт, обработчик берёт другой;
+    всего — не больше rate апдейтов в секунду (общий лимит ~30 сообщений).
+    Нажатия кнопок из очереди не обрабатываются: экран под ними мог
+    устареть, поэтому на них сразу отвечаем просьбой нажать ещё раз.
+    В памяти держится не больше max_queued апдейтов.
+    """
+
+    def __init__(self, dispatcher, workers=16, max_queued=1000, rate=25, chat_interval=1.0,
+                 stale_callback_text=STALE_CALLBACK):
+        self.dispatcher = dispatcher
+        self.workers = workers
+        self.bucket = TokenBucket(rate)
+        self.chat_interval = chat_interval
+        self.max_queued = max_queued
+        self.stale_callback_text = stale_callback_text
+        self.pending = 0  # сколько апдейтов ждало по данным Telegram
+        self.total = 0  # сколько разобрано
+        self.stale_callbacks = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    async def drain(self, bot, allowed_updates=None):
+        started = time.monotonic()
+        info = await bot.get_webhook_info()
+        self.pending += info.pending_update_count
+        if not info.pending_update_count:
+            return 0
+        logger.info("Бот %s: после перезапуска в очереди %s апдейтов", bot.id, info.pending_update_count)
+
+        chats = {}  # ключ чата -> deque апдейтов, ждущих своей очереди
+        buckets = {}  # ключ чата -> TokenBucket
+        ready = asyncio.Queue()  # чаты, которые можно разбирать
+        slots = asyncio.Semaphore(self.max_queued)
+        loop = asyncio.get_running_loop()
+        count = 0
+
+        def requeue(key):
+            ready.put_nowait(key)
+            ready.task_done()  # за отложенный get(): до сих пор чат считался незаконченным
+
+        async def worker():
+            while True:
+                key = await ready.get()
+                queue = chats[key]
+                bucket = buckets.get(key)
+                if bucket is None:
+                    bucket = buckets[key] = TokenBucket(1 / self.chat_interval, 1)
+                # Апдейт остаётся в очереди, пока обрабатывается: новые для этого чата встанут за ним
+                while queue:
+                    update = queue[0]
+                    # Ответ на устаревшее нажатие — не сообщение, лимиты на него не тратим
+                    if update.callback_query is None:
+                        if not bucket.try_acquire():
+                            loop.call_later((1 - bucket.tokens) / bucket.rate, requeue, key)
+                            break
+                        await self.bucket.acquire()
+                    await self._handle(bot, update)
+                    queue.popleft()
+                    slots.release()
+                else:
+                    del chats[key]
+                    ready.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        try:
+            offset = None
+            while True:
+                try:
+                    updates = await bot.get_updates(offset=offset, limit=100, timeout=0,
+                                                    allowed_updates=allowed_updates)
+                except Exception as e:
+                    logger.warning("Не удалось дочитать очередь апдейтов, остальное получит polling: %s", e)
+                    break
+                if not updates:
+                    break
+                for update in updates:
+                    await slots.acquire()
+                    key = chat_key(update)
+                    if key in chats:
+                        chats[key].append(update)
+                    else:
+                        chats[key] = deque([update])
+                        ready.put_nowait(key)
+                    count += 1
+                # Следующий запрос с offset подтверждает Telegram эти апдейты
+                offset = updates[-1].update_id + 1
+            await ready.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        elapsed = time.monotonic() - started
+        self.total += count
+        self.seconds = max(self.seconds, elapsed)
+        logger.info("Бот %s: очередь разобрана, %s апдейтов за %.1f сек.", bot.id, count, elapsed)
+        return count
+
+    async def _handle(self, bot, update):
+        try:
+            if update.callback_query is not None:
+                self.stale_callbacks += 1
+                await bot.answer_callback_query(update.callback_query.id, text=self.stale_callback_text)
+            else:
+                await self.dispatcher.feed_update(bot, update, backlog=True)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Апдейт %s из очереди не обработан: %s", update.update_id, e)
@@ -0,0 +1,137 @@
+"""Заглушка GigaChat для нагрузочных тестов: OAuth и /chat/completions (обычный и потоковый ответ).
+
+Задержка ответа — время до первого токена плюс время генерации с заданной
+скоростью, так что очередь за семафором AIClient видна как в жизни.
+
+    python bench/fake_gigachat.py --port 8082 --first-token 0.8 --tps 40
+    GIGACHAT_BASE_URL=http://127.0.0.1:8082/api/v1 GIGACHAT_AUTH_URL=http://127.0.0.1:8082/api/v2/oauth python main.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+ANSWER = (
+    "Отличный вопрос! В нашей первичке МБОУ СОШ №9 г. Брянска всегда что-то происходит. "
+    "Загляни в раздел «Актуальные мероприятия» и следи за новостями в группе ВК. "
+)
+
+
+class FakeGigaChat:
+    def __init__(self, first_token=0.5, tokens_per_second=40.0, answer_chars=600, chunk_chars=24, error_rate=0.0):
+        self.first_token = first_token
+        self.tokens_per_second = tokens_per_second
+        self.answer_chars = answer_chars
+        self.chunk_chars = chunk_chars
+        self.error_rate = error_rate
+        self.requests = 0
+        self.auth_calls = 0
+        self.errors = 0
+        self.active = 0
+        self.max_active = 0
+        self.url = None
+
+    def reset(self):
+        self.requests = self.auth_calls = self.errors = self.max_active = 0
+
+    @staticmethod
+    def _tokens(text):
+        return len(text) // 3 + 1
+
+    async def handle(self, request):
+        path = request.match_info["path"]
+        if path.endswith("oauth"):
+            self.auth_calls += 1
+            expires_at = int((time.time() + 1800) * 1000)
+            return web.json_response({"access_token": "bench-token", "expires_at": expires_at})
+        if not path.endswith("chat/completions"):
+            return web.json_response({"status": 404, "message": "Not found"}, status=404)
+
+        body = await request.json()
+        self.requests += 1
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"status": 503, "message": "Service unavailable"}, status=503)
+
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            prompt_tokens = sum(self._tokens(m.get("content", "")) for m in body.get("messages", []))
+            answer = (ANSWER * (self.answer_chars // len(ANSWER) + 1))[:self.answer_chars]
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": self._tokens(answer),
+                     "total_tokens": prompt_tokens + self._tokens(answer)}
+            if body.get("stream"):
+                return await self._stream(request, answer, usage)
+            await asyncio.sleep(self.first_token + usage["completion_tokens"] / self.tokens_per_second)
+            return web.json_response({
+                "choices": [{"message": {"role": "assistant", "content": answer}, "index": 0, "finish_reason": "stop"}],
+                "created": int(time.time()),
+                "model": "GigaChat",
+                "usage": usage,
+                "object": "chat.completion",
+            })
+        finally:
+            self.active -= 1
+
+    async def _stream(self, request, answer, usage):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(self.first_token)
+        parts = [answer[i:i + self.chunk_chars] for i in range(0, len(answer), self.chunk_chars)]
+        for n, part in enumerate(parts):
+            last = n == len(parts) - 1
+            chunk = {
+                "choices": [{"delta": {"role": "assistant", "content": part}, "index": 0,
+                             "finish_reason": "stop" if last else None}],
+                "created": int(time.time()),
+                "model": "GigaChat",
+                "object": "chat.completion",
+            }
+            if last:
+                chunk["usage"] = usage
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await asyncio.sleep(self._tokens(part) / self.tokens_per_second)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application()
+        app.router.add_post("/{path:.*}", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        host, port = runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return runner
+
+    @property
+    def base_url(self):
+        return f"{self.url}/api/v1"
+
+    @property
+    def auth_url(self):
+        return f"{self.url}/api/v2/oauth"
+
+
+async def serve(args):
+    giga = FakeGigaChat(first_token=args.first_token, tokens_per_second=args.tps, error_rate=args.error_rate)
+    runner = await giga.start(args.host, args.port)
+    print(f"GIGACHAT_BASE_URL={giga.base_url} GIGACHAT_AUTH_URL={giga.auth_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--first-token", type=float, default=0.5, help="задержка до первого токена, сек.")
+    parser.add_argument("--tps", type=float, default=40.0, help="скорость генерации, токенов/сек.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    asyncio.run(serve(parser.parse_args()))
@@ -0,0 +1,413 @@
+"""Postgres в памяти с интерфейсом asyncpg.Pool — для нагрузочных тестов без базы.
+
+Понимает ровно те запросы, которые шлёт бот: каждый сопоставляется с
+регулярным выражением из HANDLERS. Незнакомый запрос — NotImplementedError
+с его текстом: значит, в коде бота появился новый запрос и сюда нужно
+добавить обработчик. Задержка latency имитирует сетевой поход в базу,
+а размер пула ограничивает число одновременно занятых соединений.
+"""
+import asyncio
+import re
+import time
+
+HANDLERS = []
+
+
+def handles(pattern):
+    def register(fn):
+        HANDLERS.append((re.compile(pattern, re.I | re.S), fn))
+        return fn
+    return register
+
+
+class FakeDatabase:
+    def __init__(self, latency=0.001):
+        self.latency = latency
+        self.branches = []  # строки таблицы branches
+        self.users = {}  # (branch_id, user_id) -> {"username", "status", "last_error_at"}
+        self.events = {}  # id -> row
+        self.event_seq = 0
+        self.media_files = {}  # (branch_id, path) -> row
+        self.fsm = {}  # key -> {"state", "data", "updated_at"}
+        self.outbox = {}  # id -> {"branch_id", "chat_id", "kind", "text", "status", "attempts", "next_attempt_at"}
+        self.outbox_seq = 0
+        self.listeners = {}  # channel -> [(conn, callback), ...]
+        self.migrations = {}  # version -> name
+        self.queries = 0
+
+    def run(self, conn, sql, args):
+        self.queries += 1
+        sql = " ".join(sql.split())
+        for pattern, fn in HANDLERS:
+            if pattern.search(sql):
+                return fn(self, conn, *args)
+        raise NotImplementedError(f"fake_pg не знает запрос: {sql}")
+
+
+# --- СХЕМА ---
+@handles(r"^(CREATE|ALTER|DROP) ")
+def _create(db, conn):
+    return []
+
+
+@handles(r"^SELECT max\(version\) FROM schema_migrations$")
+def _migrations_current(db, conn):
+    return [{"max": max(db.migrations, default=None)}]
+
+
+@handles(r"^INSERT INTO schema_migrations \(version, name\) VALUES \(\$1, \$2\)$")
+def _migrations_applied(db, conn, version, name):
+    db.migrations[version] = name
+
+
+@handles(r"^SELECT pg_advisory_xact_lock\(\$1\)$")
+def _advisory_lock(db, conn, key):
+    return [{"pg_advisory_xact_lock": None}]
+
+
+@handles(r"^SELECT pg_notify\(\$1, \$2\)")
+def _notify(db, conn, channel, payload):
+    for listener, callback in db.listeners.get(channel, []):
+        callback(listener, 0, channel, payload)
+    return [{"pg_notify": None}]
+
+
+# --- BRANCHES ---
+@handles(r"^SELECT id, token, admin_chat_id, config FROM branches WHERE enabled ORDER BY id$")
+def _branches(db, conn):
+    return [dict(b) for b in db.branches if b.get("enabled", True)]
+
+
+# --- USERS ---
+@handles(r"^INSERT INTO users \(branch_id, user_id, username\) VALUES \(\$1, \$2, \$3\) ON CONFLICT")
+def _users_upsert(db, conn, branch, user_id, username):
+    db.users[branch, user_id] = {"username": username, "status": "active", "last_error_at": None}
+    return []
+
+
+@handles(r"^UPDATE users SET status = \$3, last_error_at = now\(\) WHERE branch_id = \$1 AND user_id = \$2$")
+def _users_status(db, conn, branch, user_id, status):
+    if (branch, user_id) in db.users:
+        db.users[branch, user_id].update(status=status, last_error_at=time.time())
+    return []
+
+
+def _branch_users(db, branch):
+    return {uid: u for (b, uid), u in db.users.items() if b == branch}
+
+
+@handles(r"^SELECT user_id, username, status FROM users WHERE branch_id = \$1$")
+def _users_all(db, conn, branch):
+    return [{"user_id": uid, "username": u["username"], "status": u["status"]}
+            for uid, u in _branch_users(db, branch).items()]
+
+
+@handles(r"^SELECT count\(\*\) FROM users WHERE branch_id = \$1 AND status = 'active'$")
+def _users_count(db, conn, branch):
+    return [{"count": sum(u["status"] == "active" for u in _branch_users(db, branch).values())}]
+
+
+@handles(r"^SELECT user_id FROM users WHERE branch_id = \$1 AND status = 'active' AND user_id > \$2 "
+         r"ORDER BY user_id LIMIT \$3$")
+def _users_active_page(db, conn, branch, last, limit):
+    ids = sorted(uid for uid, u in _branch_users(db, branch).items() if u["status"] == "active" and uid > last)
+    return [{"user_id": uid} for uid in ids[:limit]]
+
+
+# --- EVENTS ---
+def _event(row, columns=("id", "short_text", "long_text", "photo_id")):
+    return {c: row[c] for c in columns}
+
+
+def _events_where(db, branch, archived):
+    return [db.events[i] for i in sorted(db.events, reverse=True)
+            if db.events[i]["branch_id"] == branch and db.events[i]["archived"] == archived]
+
+
+def _branch_event(db, event_id, branch):
+    row = db.events.get(event_id)
+    return row if row is not None and row["branch_id"] == branch else None
+
+
+@handles(r"^SELECT id, short_text, long_text, photo_id FROM events WHERE branch_id = \$1 AND NOT archived "
+         r"ORDER BY id DESC$")
+def _events_active(db, conn, branch):
+    return [_event(r) for r in _events_where(db, branch, False)]
+
+
+@handles(r"^SELECT id, short_text, long_text, photo_id FROM events WHERE id = \$1 AND branch_id = \$2$")
+def _events_get(db, conn, event_id, branch):
+    row = _branch_event(db, event_id, branch)
+    return [_event(row)] if row else []
+
+
+@handles(r"^SELECT id, short_text FROM events WHERE branch_id = \$1 AND archived ORDER BY id DESC LIMIT \$2$")
+def _events_archive_first(db, conn, branch, limit):
+    return [_event(r, ("id", "short_text")) for r in _events_where(db, branch, True)[:limit]]
+
+
+@handles(r"^SELECT id, short_text FROM events WHERE branch_id = \$1 AND archived AND id < \$2 "
+         r"ORDER BY id DESC LIMIT \$3$")
+def _events_archive_older(db, conn, branch, before, limit):
+    return [_event(r, ("id", "short_text")) for r in _events_where(db, branch, True) if r["id"] < before][:limit]
+
+
+@handles(r"^SELECT id, short_text FROM events WHERE branch_id = \$1 AND archived AND id > \$2 "
+         r"ORDER BY id ASC LIMIT \$3$")
+def _events_archive_newer(db, conn, branch, after, limit):
+    rows = [r for r in reversed(_events_where(db, branch, True)) if r["id"] > after]
+    return [_event(r, ("id", "short_text")) for r in rows[:limit]]
+
+
+@handles(r"^INSERT INTO events \(branch_id, short_text, long_text, photo_id\) VALUES \(\$1, \$2, \$3, \$4\) "
+         r"RETURNING ")
+def _events_add(db, conn, branch, short_text, long_text, photo_id):
+    db.event_seq += 1
+    row = {"id": db.event_seq, "branch_id": branch, "short_text": short_text, "long_text": long_text,
+           "photo_id": photo_id, "archived": False}
+    db.events[row["id"]] = row
+    return [_event(row)]
+
+
+@handles(r"^UPDATE events SET archived = true WHERE id IN \(SELECT id FROM events WHERE branch_id = \$1 "
+         r"AND NOT archived ORDER BY id DESC OFFSET \$2\) RETURNING id$")
+def _events_archive_old(db, conn, branch, keep):
+    old = _events_where(db, branch, False)[keep:]
+    for r in old:
+        r["archived"] = True
+    return [{"id": r["id"]} for r in old]
+
+
+@handles(r"^UPDATE events SET archived = true WHERE id = \$1 AND branch_id = \$2$")
+def _events_archive(db, conn, event_id, branch):
+    row = _branch_event(db, event_id, branch)
+    if row:
+        row["archived"] = True
+    return []
+
+
+@handles(r"^DELETE FROM events WHERE id = \$1 AND branch_id = \$2$")
+def _events_delete(db, conn, event_id, branch):
+    if _branch_event(db, event_id, branch):
+        del db.events[event_id]
+    return []
+
+
+# --- MEDIA ---
+@handles(r"^SELECT path, content_hash, file_id FROM media_files WHERE branch_id = \$1$")
+def _media_all(db, conn, branch):
+    return [{k: row[k] for k in ("path", "content_hash", "file_id")}
+            for (b, _), row in db.media_files.items() if b == branch]
+
+
+@handles(r"^INSERT INTO media_files \(branch_id, path, content_hash, file_id\) VALUES \(\$1, \$2, \$3, \$4\) "
+         r"ON CONFLICT")
+def _media_upsert(db, conn, branch, path, content_hash, file_id):
+    db.media_files[branch, path] = {"path": path, "content_hash": content_hash, "file_id": file_id}
+    return []
+
+
+# --- ADMIN OUTBOX ---
+def _outbox_due(db, key=None):
+    now = time.time()
+    return [r for i, r in sorted(db.outbox.items()) if r["status"] == "pending" and r["next_attempt_at"] <= now
+            and (key is None or (r["branch_id"], r["chat_id"]) == key)]
+
+
+@handles(r"^INSERT INTO admin_outbox \(branch_id, chat_id, kind, text\) VALUES \(\$1, \$2, \$3, \$4\)$")
+def _outbox_put(db, conn, branch, chat_id, kind, text):
+    db.outbox_seq += 1
+    db.outbox[db.outbox_seq] = {"id": db.outbox_seq, "branch_id": branch, "chat_id": chat_id, "kind": kind,
+                                "text": text, "status": "pending", "attempts": 0, "next_attempt_at": time.time()}
+    return []
+
+
+@handles(r"^SELECT branch_id, chat_id FROM admin_outbox WHERE status = 'pending' AND chat_id <> 0 "
+         r"AND next_attempt_at <= now\(\) ORDER BY id LIMIT 1$")
+def _outbox_head(db, conn):
+    return [{"branch_id": r["branch_id"], "chat_id": r["chat_id"]} for r in _outbox_due(db) if r["chat_id"]][:1]
+
+
+@handles(r"^UPDATE admin_outbox SET chat_id = \$2 WHERE branch_id = \$1 AND chat_id = 0 AND status = 'pending' ")
+def _outbox_assign(db, conn, branch, chat_id):
+    parked = [r for r in db.outbox.values() if r["branch_id"] == branch and not r["chat_id"] and r["status"] == "pending"]
+    for r in parked:
+        r["chat_id"] = chat_id
+    return [{"id": r["id"]} for r in parked]
+
+
+@handles(r"^SELECT id, text FROM admin_outbox WHERE status = 'pending' AND branch_id = \$1 AND chat_id = \$2 ")
+def _outbox_batch(db, conn, branch, chat_id, limit):
+    return [{"id": r["id"], "text": r["text"]} for r in _outbox_due(db, (branch, chat_id))[:limit]]
+
+
+@handles(r"^UPDATE admin_outbox SET next_attempt_at = now\(\) \+ make_interval\(secs => \$2\) WHERE id = ANY")
+def _outbox_claim(db, conn, ids, lease):
+    claimed = [r for r in _outbox_due(db) if r["id"] in ids]
+    for r in claimed:
+        r["next_attempt_at"] = time.time() + lease
+    return [{"id": r["id"]} for r in claimed]
+
+
+@handles(r"^UPDATE admin_outbox SET next_attempt_at = now\(\) WHERE id = ANY")
+def _outbox_release(db, conn, ids):
+    for i in ids:
+        db.outbox[i]["next_attempt_at"] = time.time()
+
+
+@handles(r"^UPDATE admin_outbox SET attempts = attempts \+ 1, ")
+def _outbox_retry(db, conn, ids, error):
+    for i in ids:
+        row = db.outbox[i]
+        row["attempts"] += 1
+        row.update(last_error=error, next_attempt_at=time.time() + min(2 ** row["attempts"], 600))
+
+
+@handles(r"^UPDATE admin_outbox SET status = 'failed', last_error = \$2 WHERE id = ANY")
+def _outbox_failed(db, conn, ids, error):
+    for i in ids:
+        db.outbox[i].update(status="failed", last_error=error)
+
+
+@handles(r"^UPDATE admin_outbox SET status = 'sent', sent_at = now\(\) WHERE id = ANY")
+def _outbox_sent(db, conn, ids):
+    for i in ids:
+        db.outbox[i]["status"] = "sent"
+
+
+# --- FSM ---
+def _fsm_row(db, key, ttl):
+    row = db.fsm.get(key)
+    if row is None:
+        row = db.fsm[key] = {"state": None, "data": "{}", "updated_at": time.time()}
+    elif row["updated_at"] < time.time() - ttl:
+        row.update(state=None, data="{}")
+    row["updated_at"] = time.time()
+    return row
+
+
+@handles(r"^SELECT state, data FROM fsm_storage WHERE key = \$1 AND updated_at > ")
+def _fsm_read(db, conn, key, ttl):
+    row = db.fsm.get(key)
+    if row is None or row["updated_at"] <= time.time() - ttl:
+        return []
+    return [{"state": row["state"], "data": row["data"]}]
+
+
+@handles(r"^INSERT INTO fsm_storage \(key, state\) VALUES")
+def _fsm_set_state(db, conn, key, state, ttl):
+    _fsm_row(db, key, ttl)["state"] = state
+
+
+@handles(r"^INSERT INTO fsm_storage \(key, data\) VALUES")
+def _fsm_set_data(db, conn, key, data, ttl):
+    _fsm_row(db, key, ttl)["data"] = data
+
+
+@handles(r"^DELETE FROM fsm_storage WHERE updated_at < ")
+def _fsm_cleanup(db, conn, ttl):
+    expired = time.time() - ttl
+    for key in [k for k, r in db.fsm.items() if r["updated_at"] < expired or (r["state"] is None and r["data"] == "{}")]:
+        del db.fsm[key]
+    return []
+
+
+# --- ПУЛ ---
+class FakeConnection:
+    def __init__(self, db):
+        self._db = db
+
+    async def _run(self, sql, args):
+        if self._db.latency:
+            await asyncio.sleep(self._db.latency)
+        return self._db.run(self, sql, args) or []
+
+    async def execute(self, sql, *args, **kwargs):
+        await self._run(sql, args)
+        return "OK"
+
+    async def executemany(self, sql, args, **kwargs):
+        if self._db.latency:
+            await asyncio.sleep(self._db.latency)
+        for row in args:
+            self._db.run(self, sql, row)
+
+    async def fetch(self, sql, *args, **kwargs):
+        return await self._run(sql, args)
+
+    async def fetchrow(self, sql, *args, **kwargs):
+        rows = await self._run(sql, args)
+        return rows[0] if rows else None
+
+    async def fetchval(self, sql, *args, column=0, **kwargs):
+        row = await self.fetchrow(sql, *args)
+        return list(row.values())[column] if row else None
+
+    def transaction(self):
+        return _Transaction()
+
+    async def add_listener(self, channel, callback):
+        self._db.listeners.setdefault(channel, []).append((self, callback))
+
+    async def remove_listener(self, channel, callback):
+        listeners = self._db.listeners.get(channel, [])
+        listeners[:] = [item for item in listeners if item[1] != callback]
+
+
+class _Transaction:
+    # Откатывать нечего: обработчики заглушки не падают посреди изменения
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _Acquire:
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+
+    async def _acquire(self):
+        self._conn = await self._pool._take()
+        return self._conn
+
+    def __await__(self):
+        return self._acquire().__await__()
+
+    async def __aenter__(self):
+        return await self._acquire()
+
+    async def __aexit__(self, *exc):
+        await self._pool.release(self._conn)
+
+
+class FakePool:
+    def __init__(self, db=None, max_size=10, latency=0.001):
+        self.db = db or FakeDatabase(latency)
+        self._max_size = max_size
+        self._idle = [FakeConnection(self.db) for _ in range(max_size)]
+        self._available = asyncio.Semaphore(max_size)
+
+    async def _take(self):
+        await self._available.acquire()
+        return self._idle.pop()
+
+    def acquire(self):
+        return _Acquire(self)
+
+    async def release(self, conn):
+        self._idle.append(conn)
+        self._available.release()
+
+    def get_size(self):
+        return self._max_size
+
+    def get_idle_size(self):
+        return len(self._idle)
+
+    def get_max_size(self):
+        return self._max_size
+
+    async def close(self):
+        pass
@@ -0,0 +1,167 @@
+"""Заглушка Bot API для нагрузочных тестов.
+
+Отвечает на методы, которыми пользуется бот, правдоподобными объектами
+Message и, как настоящий Telegram, возвращает 429 с retry_after при
+превышении лимитов: ~30 новых сообщений в секунду на бота (массовые
+отправки), ~1 сообщение или правка в секунду в личный чат и ~20 в минуту
+в группу.
+
+    python bench/fake_telegram.py --port 8081
+    TELEGRAM_API_URL=http://127.0.0.1:8081 python main.py
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import sys
+import time
+from collections import Counter
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ratelimit import TokenBucket  # noqa: E402
+
+LIMITED = ("send", "edit", "copy", "forward")
+
+
+class FakeTelegram:
+    def __init__(self, global_rate=30.0, chat_rate=1.0, chat_burst=3, group_rate=20 / 60, group_burst=3,
+                 latency=0.0):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate, self.chat_burst = chat_rate, chat_burst
+        self.group_rate, self.group_burst = group_rate, group_burst
+        self.latency = latency
+        self.calls = Counter()  # method -> число вызовов
+        self.retry_after = Counter()  # method -> число ответов 429
+        self.first_sent = {}  # chat_id -> когда в чат впервые ушло сообщение (после reset)
+        self.blocked = set()  # chat_id пользователей, заблокировавших бота: на отправку им — 403
+        self.pending = []  # апдейты, ждущие getUpdates (бот «был выключен»)
+        self.url = None
+        self._chats = {}
+        self._ids = itertools.count(1)
+        self._files = itertools.count(1)
+
+    def reset(self):
+        """Новый сценарий: счётчики и лимиты чатов с нуля."""
+        self._chats.clear()
+        self.calls.clear()
+        self.retry_after.clear()
+        self.first_sent.clear()
+
+    def _limit(self, method, chat_id):
+        """Сколько секунд просить подождать или 0, если сообщение можно отправить."""
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        if not bucket.try_acquire():
+            return math.ceil((1 - bucket.tokens) / bucket.rate)
+        if method.startswith("send") and not self.global_bucket.try_acquire():
+            bucket.tokens += 1
+            return math.ceil((1 - self.global_bucket.tokens) / self.global_bucket.rate)
+        return 0
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method.startswith(LIMITED) and int(params.get("chat_id", 0)) in self.blocked:
+            self.calls["forbidden"] += 1
+            return web.json_response({"ok": False, "error_code": 403,
+                                      "description": "Forbidden: bot was blocked by the user"}, status=403)
+        if method.startswith(LIMITED):
+            wait = self._limit(method, int(params.get("chat_id", 0)))
+            if wait:
+                self.retry_after[method] += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {wait}",
+                    "parameters": {"retry_after": wait},
+                }, status=429)
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    def _file_id(self, value, kind):
+        # Строка — это уже file_id, иначе бот загрузил файл и ждёт новый
+        if isinstance(value, str) and not value.startswith("attach://"):
+            return value
+        return f"{kind}-{next(self._files)}"
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": len(self.pending)}
+        if method == "getUpdates":
+            # offset подтверждает всё, что раньше него
+            offset = int(params.get("offset") or 0)
+            self.pending = [u for u in self.pending if u["update_id"] >= offset]
+            return self.pending[:int(params.get("limit") or 100)]
+        if method == "deleteWebhook" and params.get("drop_pending_updates") == "true":
+            self.pending.clear()
+        if not method.startswith(LIMITED):
+            return True
+
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": int(params.get("message_id") or next(self._ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+        }
+        if method == "editMessageMedia":
+            media = json.loads(params["media"])
+            params = {**params, media["type"]: media["media"], "caption": media.get("caption")}
+            method = "sendPhoto" if media["type"] == "photo" else "sendDocument"
+        if method == "sendPhoto":
+            file_id = self._file_id(params["photo"], "photo")
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 720}]
+        elif method == "sendDocument":
+            file_id = self._file_id(params["document"], "document")
+            message["document"] = {"file_id": file_id, "file_unique_id": file_id}
+        if params.get("caption"):
+            message["caption"] = params["caption"]
+        if params.get("text"):
+            message["text"] = params["text"]
+
+        if method.startswith("send"):
+            self.first_sent.setdefault(chat_id, time.monotonic())
+        return message
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        host, port = runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return runner
+
+
+async def serve(args):
+    telegram = FakeTelegram(global_rate=args.global_rate, chat_rate=args.chat_rate, latency=args.latency)
+    runner = await telegram.start(args.host, args.port)
+    print(f"Bot API: {telegram.url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--global-rate", type=float, default=30.0)
+    parser.add_argument("--chat-rate", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, сек.")
+    asyncio.run(serve(parser.parse_args()))
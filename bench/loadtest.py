@@ -0,0 +1,436 @@
+"""Нагрузочный тест бота целиком, без Telegram, GigaChat и (по желанию) Postgres.
+
+Поднимает заглушки Bot API (fake_telegram) и GigaChat (fake_gigachat), база —
+Postgres в памяти (fake_pg) или настоящая одноразовая из BENCH_DATABASE_URL.
+Апдейты подаются прямо в dp.feed_update, как это делает polling/webhook,
+с ограничением числа одновременно обрабатываемых.
+
+    python bench/loadtest.py --users 500
+    python bench/loadtest.py --users 2000 --scenarios start_storm ai_burst --json after.json --baseline before.json
+
+Сценарии: start_storm — все разом жмут /start; menu_browsing — ходят по
+разделам меню; join_form — заполняют анкету вступления (эти двое приходят
+в течение --ramp сек.); ai_burst — разом спрашивают нейросеть; broadcast — две рассылки на --users получателей,
+часть которых (--blocked) заблокировала бота; restart_backlog — пока бот
+перезапускался, ученики дописали начатые анкеты, нажали /start и кнопки,
+а бот разбирает накопившуюся очередь.
+Для каждого: число апдейтов, ошибки, отказы антиспама, ответы 429 от
+Bot API, запросы к GigaChat, пропускная способность и p50/p95/p99 времени обработки. Для
+рассылки время — от запуска второй рассылки до доставки каждому получателю.
+Сломанный сценарий (рассылка не дошла, анкета потерялась) помечается
+ПРОВАЛ, и скрипт завершается с кодом 1.
+
+Настройки бота (THROTTLE_*, AI_*, BROADCAST_*, DB_POOL_MAX...) берутся из
+окружения, как обычно.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass, field
+
+from aiogram.types import Update
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fake_gigachat import FakeGigaChat  # noqa: E402
+from bench.fake_pg import FakePool  # noqa: E402
+from bench.fake_telegram import FakeTelegram  # noqa: E402
+
+ADMIN_CHAT = -1000000000001
+ADMIN_USER = 1
+SCENARIOS = ("start_storm", "menu_browsing", "join_form", "ai_burst", "broadcast", "restart_backlog")
+
+QUESTIONS = [
+    "кто куратор?",
+    "как вступить в движение первых",
+    "что будет на этой неделе",
+    "кто председатель правления движения",
+    "какие ценности у движения",
+    "есть ли у нас школьное радио",
+]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+@dataclass
+class Result:
+    name: str
+    ops: int = 0
+    errors: int = 0
+    throttled: int = 0
+    retry_after: int = 0
+    ai_requests: int = 0
+    duration: float = 0.0
+    latencies: list = field(default_factory=list, repr=False)
+    last_error: str = ""
+    note: str = ""
+    failures: list = field(default_factory=list)  # что сломалось в сценарии, а не просто замедлилось
+
+    @property
+    def throughput(self):
+        return self.ops / self.duration if self.duration else 0.0
+
+    @property
+    def error_rate(self):
+        return self.errors / self.ops if self.ops else 0.0
+
+    def summary(self):
+        return {
+            "ops": self.ops,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate, 4),
+            "throttled": self.throttled,
+            "retry_after": self.retry_after,
+            "ai_requests": self.ai_requests,
+            "failures": len(self.failures),
+            "duration": round(self.duration, 3),
+            "throughput": round(self.throughput, 1),
+            **{f"p{q}_ms": round(percentile(self.latencies, q / 100) * 1000, 1) for q in (50, 95, 99)},
+        }
+
+
+class Harness:
+    def __init__(self, bot_main, telegram, giga, concurrency):
+        self.main = bot_main
+        self.branch = next(iter(bot_main.branches))  # однофилиальный режим: BOT_TOKEN и ADMIN_GROUP_ID
+        self.telegram = telegram
+        self.giga = giga
+        self._sem = asyncio.Semaphore(concurrency)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._user_ids = itertools.count(100000)
+        self.event_ids = []
+
+    def users(self, n):
+        """Свежие пользователи для каждого сценария, чтобы лимиты прошлого не мешали."""
+        return [{"id": uid, "is_bot": False, "first_name": "Ученик", "username": f"student{uid}"}
+                for uid in itertools.islice(self._user_ids, n)]
+
+    def _message(self, user, chat=None, **content):
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": chat or {"id": user["id"], "type": "private"},
+            "from": user,
+            **content,
+        }
+
+    def message(self, user, text, chat=None):
+        return {"update_id": next(self._update_ids), "message": self._message(user, chat, text=text)}
+
+    def callback(self, user, data, chat=None, photo=True):
+        # Кнопка нажата под прошлым сообщением бота: экраном с фото (как главное меню) или текстовым
+        if photo:
+            shown = self._message(user, chat, photo=[{"file_id": "menu", "file_unique_id": "menu", "width": 1,
+                                                      "height": 1}], caption="Главное меню")
+        else:
+            shown = self._message(user, chat, text="Меню разделов")
+        shown["from"] = {"id": 1, "is_bot": True, "first_name": "Bench"}
+        return {"update_id": next(self._update_ids),
+                "callback_query": {"id": str(next(self._update_ids)), "from": user, "chat_instance": "bench",
+                                   "data": data, "message": shown}}
+
+    async def feed(self, update, result):
+        bot = self.branch.bot
+        async with self._sem:
+            started = time.perf_counter()
+            try:
+                await self.main.dp.feed_update(bot, Update.model_validate(update, context={"bot": bot}))
+            except Exception as e:
+                result.errors += 1
+                result.last_error = f"{type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}"
+            finally:
+                result.latencies.append(time.perf_counter() - started)
+                result.ops += 1
+
+    async def measure(self, name, scenario, *args):
+        result = Result(name)
+        self.telegram.reset()
+        self.giga.reset()
+        rejected = self.main.throttling.rejected
+        # Каждый сценарий начинается с полным общим ведром ИИ, прошлые не влияют
+        bucket = self.main.throttling.global_ai
+        bucket.tokens = bucket.capacity
+        started = time.perf_counter()
+        await scenario(self, result, *args)
+        result.duration = time.perf_counter() - started
+        result.throttled = self.main.throttling.rejected - rejected
+        result.retry_after = sum(self.telegram.retry_after.values())
+        result.ai_requests = self.giga.requests
+        return result
+
+
+# --- СЦЕНАРИИ ---
+def lost_replies(result, what):
+    # Ответ, упавший с 429, не доходит до пользователя, а хендлер — до смены состояния
+    if result.errors:
+        result.failures.append(f"{what}: {result.errors} апдейтов упали, ответы потеряны")
+
+
+async def start_storm(h, result, n, args):
+    await asyncio.gather(*(h.feed(h.message(u, "/start"), result) for u in h.users(n)))
+    lost_replies(result, "/start")
+
+
+async def menu_browsing(h, result, n, args):
+    async def session(user):
+        await asyncio.sleep(random.uniform(0, args.ramp))
+        # (кнопка, есть ли фото на открывшемся экране): от этого зависит, правит бот сообщение или шлёт новое
+        steps = [("main_menu", True), ("menu_sections", False), ("sec_about_movement", False), ("sec_projects", True),
+                 ("sec_our_branch", True), ("list_events", False)]
+        if h.event_ids:
+            steps.append((f"view_event_{random.choice(h.event_ids)}", False))
+        steps.append(("main_menu", True))
+        shown_photo = True
+        for data, photo in steps:
+            await h.feed(h.callback(user, data, photo=shown_photo), result)
+            shown_photo = photo
+            await asyncio.sleep(args.think * random.uniform(0.5, 1.5))
+
+    await asyncio.gather(*(session(u) for u in h.users(n)))
+    lost_replies(result, "меню")
+
+
+async def join_form(h, result, n, args):
+    async def session(user):
+        await asyncio.sleep(random.uniform(0, args.ramp))
+        await h.feed(h.callback(user, "join_movement"), result)
+        for text in ("Иванов Иван Иванович", "14", "8Б", "Медиа", "Люблю фотографировать и снимать видео"):
+            await asyncio.sleep(args.think * random.uniform(0.5, 1.5))
+            await h.feed(h.message(user, text), result)
+
+    outbox = h.main.admin_outbox
+    queued, sent, messages = outbox.queued, outbox.sent, outbox.messages
+    await asyncio.gather(*(session(u) for u in h.users(n)))
+    # Заявки уходят админам фоном; за время сценария — сколько и каким числом сообщений
+    forms = outbox.queued - queued
+    result.note = (f"заявок {forms}, из них админам доставлено {outbox.sent - sent} "
+                   f"в {outbox.messages - messages} сообщениях")
+    lost_replies(result, "анкета")
+    if forms < n:
+        result.failures.append(f"анкет собрано {forms} из {n}")
+    if h.giga.requests:
+        # Анкета застряла на шаге — следующие ответы ученика ушли нейросети как вопросы
+        result.failures.append(f"ответы анкеты ушли нейросети: {h.giga.requests} запросов к GigaChat")
+
+
+async def ai_burst(h, result, n, args):
+    def question(i):
+        # Часть вопросов уникальна (мимо кэша ответов), остальные — частые
+        q = random.choice(QUESTIONS)
+        return f"{q} про {i}" if random.random() < args.ai_unique else q
+
+    await asyncio.gather(*(h.feed(h.message(u, question(i)), result) for i, u in enumerate(h.users(n))))
+
+
+async def broadcast(h, result, n, args):
+    recipients = h.users(n)
+    for u in recipients:
+        h.branch.users.register(u["id"], u["username"])
+    # Часть получателей заблокировала бота: первая рассылка на них спотыкается, вторая их уже пропускает
+    blocked = {u["id"] for u in random.sample(recipients, int(n * args.blocked))}
+    h.telegram.blocked |= blocked
+    admin = {"id": ADMIN_USER, "is_bot": False, "first_name": "Админ"}
+    chat = {"id": ADMIN_CHAT, "type": "supergroup"}
+
+    expected = len(recipients) - len(blocked)
+
+    async def run_broadcast(name, text):
+        errors = result.errors
+        await h.feed(h.callback(admin, "broadcast_msg", chat, photo=False), result)
+        await h.feed(h.message(admin, text, chat), result)
+        h.telegram.first_sent.clear()
+        started = time.monotonic()
+        await h.feed(h.message(admin, "нет", chat), result)
+        await h.branch.broadcaster.wait_all()
+        if result.errors > errors:
+            result.failures.append(f"{name}: ошибок в диалоге админа {result.errors - errors}")
+        delivered = [h.telegram.first_sent[u["id"]] - started for u in recipients if u["id"] in h.telegram.first_sent]
+        if not delivered:
+            result.failures.append(f"{name} не запустилась")
+        elif len(delivered) < expected:
+            result.failures.append(f"{name} дошла до {len(delivered)} из {expected}")
+        return delivered
+
+    await run_broadcast("первая рассылка", "Завтра субботник, приходите!")
+    forbidden = h.telegram.calls["forbidden"]
+    delivered = await run_broadcast("вторая рассылка", "Напоминаем: субботник завтра в 10:00!")
+    repeated = h.telegram.calls["forbidden"] - forbidden
+    result.note = f"403 в повторной рассылке: {repeated} из {len(blocked)} заблокировавших"
+    if repeated:
+        result.failures.append(f"вторая рассылка снова писала {repeated} заблокировавшим")
+
+    # Дальше считаем не апдейты, а доставку второй рассылки: сколько ждал каждый получатель
+    result.ops = expected
+    result.latencies = delivered
+    result.errors = expected - len(delivered)
+
+
+async def restart_backlog(h, result, n, args):
+    users = h.users(n)
+    # Анкету начали до перезапуска (состояние уже в хранилище), остальное Telegram держал в очереди
+    for u in users:
+        context = h.main.dp.fsm.get_context(h.branch.bot, chat_id=u["id"], user_id=u["id"])
+        await context.set_state(h.main.JoinState.waiting_for_fio)
+    for text in ("Иванов Иван Иванович", "14", "8Б", "Медиа", "Люблю фотографировать и снимать видео"):
+        h.telegram.pending += [h.message(u, text) for u in users]
+    others = h.users(n)
+    h.telegram.pending += [h.message(u, "/start") for u in others] + [h.callback(u, "menu_sections") for u in others]
+    h.telegram.reset()
+
+    backlog, outbox = h.main.backlog, h.main.admin_outbox
+    total, stale, errors, queued = backlog.total, backlog.stale_callbacks, backlog.errors, outbox.queued
+    await backlog.drain(h.branch.bot)
+    result.ops = backlog.total - total
+    result.errors = backlog.errors - errors
+    # Анкета дойдёт до админов, только если ответы одного ученика разобраны по порядку
+    forms = outbox.queued - queued
+    result.note = (f"очередь {result.ops} апдейтов за {backlog.seconds:.1f} сек.: анкет собрано "
+                   f"{forms} из {n}, устаревших нажатий {backlog.stale_callbacks - stale}")
+    if forms < n:
+        result.failures.append(f"анкет собрано {forms} из {n}")
+
+
+RUNNERS = {
+    "start_storm": start_storm,
+    "menu_browsing": menu_browsing,
+    "join_form": join_form,
+    "ai_burst": ai_burst,
+    "broadcast": broadcast,
+    "restart_backlog": restart_backlog,
+}
+
+
+# --- ЗАПУСК ---
+async def create_pool(bot_main, args):
+    dsn = os.getenv("BENCH_DATABASE_URL")
+    if dsn:
+        bot_main.DATABASE_URL = dsn
+        pool = await bot_main.create_pool()
+    else:
+        raw = FakePool(max_size=bot_main.DB_POOL_MAX, latency=args.db_latency)
+        bot_main.metrics.watch_pool(raw)
+        pool = bot_main.metrics.InstrumentedPool(raw)
+    await bot_main.create_tables(pool)
+    return pool
+
+
+def report(results):
+    header = f"{'сценарий':<15}{'апдейтов':>9}{'ошибок':>8}{'лимит':>7}{'429':>6}{'ИИ':>6}{'сек':>8}{'в сек':>8}" \
+             f"{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        s = r.summary()
+        print(f"{r.name:<15}{s['ops']:>9}{s['errors']:>8}{s['throttled']:>7}{s['retry_after']:>6}{s['ai_requests']:>6}"
+              f"{s['duration']:>8.1f}{s['throughput']:>8.1f}{s['p50_ms']:>9.0f}{s['p95_ms']:>9.0f}{s['p99_ms']:>9.0f}")
+        if r.note:
+            print(f"  {r.note}")
+        if r.last_error:
+            print(f"  последняя ошибка: {r.last_error[:160]}")
+        for failure in r.failures:
+            print(f"  ПРОВАЛ: {failure}")
+
+
+def compare(results, baseline_path, tolerance):
+    """Регрессии относительно прошлого прогона: p95 и доля ошибок не должны вырасти больше чем на tolerance."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    failed = []
+    for r in results:
+        old = baseline.get(r.name)
+        if not old:
+            continue
+        new = r.summary()
+        if new["p95_ms"] > old["p95_ms"] * (1 + tolerance) and new["p95_ms"] - old["p95_ms"] > 5:
+            failed.append(f"{r.name}: p95 {old['p95_ms']} -> {new['p95_ms']} мс")
+        if new["error_rate"] > old["error_rate"] + tolerance / 10:
+            failed.append(f"{r.name}: ошибки {old['error_rate']:.1%} -> {new['error_rate']:.1%}")
+    for line in failed:
+        print("РЕГРЕССИЯ", line)
+    return not failed
+
+
+async def run(args):
+    os.chdir(ROOT)
+    telegram = FakeTelegram(chat_rate=args.chat_rate, latency=args.api_latency)
+    giga = FakeGigaChat(first_token=args.first_token, tokens_per_second=args.tps, error_rate=args.ai_error_rate)
+    runners = [await telegram.start(), await giga.start()]
+
+    os.environ.update(
+        BOT_TOKEN="123456:loadtest",
+        ADMIN_GROUP_ID=str(ADMIN_CHAT),
+        GIGACHAT_KEY="YmVuY2g6YmVuY2g=",
+        TELEGRAM_API_URL=telegram.url,
+        GIGACHAT_BASE_URL=giga.base_url,
+        GIGACHAT_AUTH_URL=giga.auth_url,
+    )
+    os.environ.setdefault("METRICS_PORT", "0")
+    import main as bot_main
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    pool = await create_pool(bot_main, args)
+    await bot_main.on_startup(pool)
+    bot_main.lifecycle.mark_ready()
+    results = []
+    try:
+        h = Harness(bot_main, telegram, giga, args.concurrency)
+        for i in range(args.events):
+            row = await bot_main.add_event_db(h.branch, pool, f"Мероприятие #{i + 1}",
+                                              f"Подробности мероприятия #{i + 1}: место, время, что взять с собой.", None)
+            h.event_ids.append(row["id"])
+        for name in args.scenarios:
+            result = await h.measure(name, RUNNERS[name], args.users, args)
+            results.append(result)
+            print(f"{name}: готово за {result.duration:.1f} сек.", file=sys.stderr)
+    finally:
+        await bot_main.on_shutdown(pool)
+        for runner in runners:
+            await runner.cleanup()
+
+    print()
+    report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({r.name: r.summary() for r in results}, f, ensure_ascii=False, indent=2)
+    ok = not any(r.failures for r in results)
+    if args.baseline:
+        ok = compare(results, args.baseline, args.tolerance) and ok
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--users", type=int, default=200, help="пользователей (получателей) в каждом сценарии")
+    parser.add_argument("--concurrency", type=int, default=100, help="апдейтов в обработке одновременно")
+    parser.add_argument("--think", type=float, default=1.5, help="пауза между действиями пользователя, сек.")
+    parser.add_argument("--ramp", type=float, default=10.0,
+                        help="menu_browsing и join_form: пользователи приходят в течение N сек., а не разом")
+    parser.add_argument("--ai-unique", type=float, default=0.5, help="ai_burst: доля уникальных вопросов")
+    parser.add_argument("--blocked", type=float, default=0.1, help="broadcast: доля заблокировавших бота")
+    parser.add_argument("--events", type=int, default=20, help="мероприятий в базе")
+    parser.add_argument("--db-latency", type=float, default=0.001, help="задержка запроса к fake_pg, сек.")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="задержка ответа Bot API, сек.")
+    parser.add_argument("--chat-rate", type=float, default=1.0, help="лимит Bot API на один чат, сообщений/сек.")
+    parser.add_argument("--first-token", type=float, default=0.5, help="GigaChat: задержка до первого токена, сек.")
+    parser.add_argument("--tps", type=float, default=40.0, help="GigaChat: токенов в секунду")
+    parser.add_argument("--ai-error-rate", type=float, default=0.0, help="GigaChat: доля ответов 503")
+    parser.add_argument("--json", help="сохранить результаты в файл")
+    parser.add_argument("--baseline", help="сравнить с результатами прошлого прогона")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение p95 (доля)")
+    ok = asyncio.run(run(parser.parse_args()))
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,106 @@
+"""Офлайн-сравнение промптов: вся база целиком против выборки по вопросу.
+
+    python bench/retrieval_bench.py --events 10 100 500
+    python bench/retrieval_bench.py --live        # плюс реальные запросы в GigaChat (нужен GIGACHAT_KEY)
+
+Без --live задержка ответа оценивается линейной моделью по числу токенов
+промпта (--base-ms и --ms-per-1k), этого хватает, чтобы увидеть рост.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("ADMIN_GROUP_ID", "0")
+
+from main import BASE_SYSTEM_PROMPT  # noqa: E402
+from retrieval import KnowledgeBase, estimate_tokens, stuff_prompt  # noqa: E402
+
+QUESTIONS = [
+    "кто куратор?",
+    "как вступить в движение первых",
+    "что будет на этой неделе",
+    "когда субботник",
+    "кто председатель правления движения",
+    "какие ценности у движения",
+    "есть ли у нас школьное радио",
+    "что за книжный клуб",
+]
+
+TOPICS = ["Субботник", "Квиз по истории", "Акция «Письмо солдату»", "Турнир по волейболу", "Мастер-класс по фото",
+          "Концерт ко Дню матери", "Сбор макулатуры", "Экскурсия в музей", "Встреча с ветеранами", "Школьное радио"]
+
+
+def make_events(n):
+    rnd = random.Random(n)
+    events = []
+    for i in range(n, 0, -1):
+        topic = rnd.choice(TOPICS)
+        long_text = (f"{topic} пройдёт {rnd.randint(1, 28)} числа в {rnd.randint(9, 17)}:00. "
+                     f"Место сбора — {rnd.choice(['актовый зал', 'спортзал', 'кабинет 21', 'школьный двор'])}. "
+                     "Приглашаем всех желающих, возьмите с собой хорошее настроение и друзей. " * rnd.randint(1, 4))
+        events.append({"id": i, "short_text": f"{topic} #{i}", "long_text": long_text})
+    return events
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def live_latency(prompt, question):
+    from ai_client import AIClient
+    client = AIClient(os.environ["GIGACHAT_KEY"], max_concurrency=1)
+    try:
+        started = time.perf_counter()
+        await client.chat([{"role": "system", "content": prompt}, {"role": "user", "content": question}])
+        return time.perf_counter() - started
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, nargs="+", default=[0, 10, 100, 500])
+    parser.add_argument("--top-k", type=int, default=8)
+    parser.add_argument("--budget", type=int, default=1200)
+    parser.add_argument("--base-ms", type=float, default=800.0, help="задержка модели без промпта, мс")
+    parser.add_argument("--ms-per-1k", type=float, default=250.0, help="прирост задержки на 1000 токенов промпта, мс")
+    parser.add_argument("--live", action="store_true")
+    args = parser.parse_args()
+
+    print(f"{'events':>6} | {'mode':<9} | {'tokens avg':>10} | {'tokens max':>10} | {'build p50 ms':>12} | {'answer est ms':>13}")
+    for n in args.events:
+        events = make_events(n)
+        started = time.perf_counter()
+        kb = KnowledgeBase(BASE_SYSTEM_PROMPT, top_k=args.top_k, token_budget=args.budget)
+        kb.sync_events(events, version=1)
+        index_ms = (time.perf_counter() - started) * 1000
+
+        for mode in ("full", "retrieval"):
+            tokens, build = [], []
+            for q in QUESTIONS:
+                started = time.perf_counter()
+                if mode == "full":
+                    prompt = stuff_prompt(BASE_SYSTEM_PROMPT, events)
+                else:
+                    prompt = kb.build_prompt(q, events, version=1)
+                build.append((time.perf_counter() - started) * 1000)
+                tokens.append(estimate_tokens(prompt))
+            avg = statistics.mean(tokens)
+            est = args.base_ms + args.ms_per_1k * avg / 1000
+            print(f"{n:>6} | {mode:<9} | {avg:>10.0f} | {max(tokens):>10} | {percentile(build, 0.5):>12.2f} | {est:>13.0f}")
+            if args.live:
+                prompt = stuff_prompt(BASE_SYSTEM_PROMPT, events) if mode == "full" else kb.build_prompt(QUESTIONS[0], events, 1)
+                latency = asyncio.run(live_latency(prompt, QUESTIONS[0]))
+                print(f"{'':>6} | {'':<9} | живой ответ GigaChat: {latency * 1000:.0f} мс")
+        print(f"{'':>6} | индекс на {n} мероприятий построен за {index_ms:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
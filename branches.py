@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Филиал однофилиального режима; им же помечены строки, созданные до появления филиалов
+DEFAULT_BRANCH = "main"
+
+
+@dataclass
+class Branch:
+    """Филиал (школа): свой бот, админский чат, база знаний, тексты экранов и картинки.
+
+    Пул БД, диспетчер, клиент GigaChat и HTTP-сессия к Bot API у всех
+    филиалов общие, а данные в таблицах помечены branch_id.
+    """
+
+    id: str
+    token: str
+    admin_chat_id: int = 0
+    prompt: str = None  # база знаний для нейросети; None — общая из main.py
+    texts: dict = field(default_factory=dict)  # ключ экрана -> текст (поверх текстов из main.py)
+    files: dict = field(default_factory=dict)  # путь по умолчанию -> файл филиала, например img/main.jpg
+    media_upload_chat_id: int = 0
+
+    # Объекты филиала, их создаёт main.setup_branch
+    bot: object = field(default=None, repr=False)
+    events: object = field(default=None, repr=False)
+    users: object = field(default=None, repr=False)
+    media: object = field(default=None, repr=False)
+    screens: object = field(default=None, repr=False)
+    knowledge: object = field(default=None, repr=False)
+    answers: object = field(default=None, repr=False)
+    broadcaster: object = field(default=None, repr=False)
+
+    def path(self, path):
+        return self.files.get(path, path)
+
+    @classmethod
+    def from_config(cls, data, base_dir=None):
+        """Филиал из словаря настроек; prompt_file и пути в files — относительно base_dir (или текущего каталога)."""
+        def resolve(p):
+            return os.path.join(base_dir, p) if base_dir else p
+
+        prompt = data.get("prompt")
+        if data.get("prompt_file"):
+            with open(resolve(data["prompt_file"]), encoding="utf-8") as f:
+                prompt = f.read()
+        return cls(
+            id=data["id"],
+            token=data.get("token") or os.getenv(data.get("token_env", ""), ""),
+            admin_chat_id=int(data.get("admin_chat_id") or 0),
+            prompt=prompt,
+            texts=dict(data.get("texts") or {}),
+            files={k: resolve(v) for k, v in (data.get("files") or {}).items()},
+            media_upload_chat_id=int(data.get("media_upload_chat_id") or 0),
+        )
+
+
+def load_from_dir(path):
+    """Филиалы из каталога: по одному JSON-файлу на филиал (id, token или token_env, admin_chat_id, ...)."""
+    branches = []
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(path, name), encoding="utf-8") as f:
+            data = json.load(f)
+        data.setdefault("id", name[:-len(".json")])
+        branches.append(Branch.from_config(data, base_dir=path))
+    return branches
+
+
+async def load_from_db(pool):
+    """Включённые филиалы из таблицы branches; в config — те же ключи, что в JSON-файлах."""
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("SELECT id, token, admin_chat_id, config FROM branches WHERE enabled ORDER BY id")
+    branches = []
+    for row in rows:
+        config = row['config']
+        data = json.loads(config) if isinstance(config, str) else dict(config or {})
+        data.update(id=row['id'], token=row['token'], admin_chat_id=row['admin_chat_id'])
+        branches.append(Branch.from_config(data))
+    return branches
+
+
+class Branches(BaseMiddleware):
+    """Реестр филиалов и внешний middleware: кладёт в данные хендлера branch по боту, получившему апдейт."""
+
+    def __init__(self):
+        self._by_id = {}
+        self._by_bot = {}
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def add(self, branch):
+        if branch.id in self._by_id:
+            raise ValueError(f"Филиал {branch.id} описан дважды")
+        self._by_id[branch.id] = branch
+        self._by_bot[branch.bot.id] = branch
+
+    def get(self, branch_id):
+        return self._by_id.get(branch_id)
+
+    def bot(self, branch_id):
+        branch = self._by_id.get(branch_id)
+        return branch.bot if branch else None
+
+    async def __call__(self, handler, event, data):
+        branch = self._by_bot.get(data["bot"].id)
+        if branch is None:
+            logger.warning("Апдейт для незнакомого бота %s пропущен", data["bot"].id)
+            return None
+        data["branch"] = branch
+        return await handler(event, data)
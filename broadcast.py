@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from ratelimit import KeyedInterval, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BroadcastStats:
+    title: str
+    total: int = 0
+    delivered: int = 0
+    failed: int = 0
+    blocked: int = 0
+    deactivated: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def done(self):
+        return self.delivered + self.failed + self.blocked + self.deactivated
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started_at
+        return (
+            f"📢 <b>{self.title}</b>\n"
+            f"Обработано: {self.done}/{self.total}\n"
+            f"✅ Доставлено: {self.delivered}\n"
+            f"🚫 Заблокировали бота: {self.blocked}\n"
+            f"👻 Удалили аккаунт: {self.deactivated}\n"
+            f"⚠️ Ошибки: {self.failed}\n"
+            f"⏱ {elapsed:.0f} сек."
+        )
+
+
+class Broadcaster:
+    """Фоновые рассылки с общим лимитом скорости и лимитом на один чат.
+
+    Получатели читаются по мере отправки (подойдёт и async-итератор из БД),
+    в памяти только небольшая очередь. Тех, до кого сообщение не дойдёт
+    никогда (заблокировали бота, удалили аккаунт), передаём в
+    on_undeliverable(chat_id, status), чтобы в следующий раз их пропустить.
+    """
+
+    def __init__(self, bot, rate=25, per_chat_interval=1.0, concurrency=10, max_retries=3, progress_interval=5.0,
+                 on_undeliverable=None):
+        self.bot = bot
+        self.on_undeliverable = on_undeliverable
+        self.bucket = TokenBucket(rate)
+        self.per_chat = KeyedInterval(per_chat_interval)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self._tasks = set()
+
+    def start(self, recipients, send, report_chat_id=None, title="Рассылка", total=None):
+        """Запускает рассылку в фоне. send(chat_id) — корутина, отправляющая одно сообщение."""
+        task = asyncio.create_task(self.run(recipients, send, report_chat_id, title, total))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def run(self, recipients, send, report_chat_id=None, title="Рассылка", total=None):
+        if total is None:
+            total = len(recipients) if hasattr(recipients, "__len__") else 0
+        stats = BroadcastStats(title=title, total=total)
+        queue = asyncio.Queue(maxsize=self.concurrency * 10)
+
+        producer = asyncio.create_task(self._produce(recipients, queue))
+        workers = [asyncio.create_task(self._worker(queue, send, stats)) for _ in range(self.concurrency)]
+        progress_msg = reporter = None
+        try:
+            # Рассылка уже идёт: если админский чат упёрся в лимит, прогресс подождёт, а получатели — нет
+            if report_chat_id is not None:
+                try:
+                    progress_msg = await self.bot.send_message(report_chat_id, stats.summary(), parse_mode="HTML")
+                except Exception as e:
+                    logger.warning("Не удалось отправить прогресс рассылки: %s", e)
+            if progress_msg is not None:
+                reporter = asyncio.create_task(self._report_progress(progress_msg, stats))
+            await asyncio.gather(producer, *workers)
+        except asyncio.CancelledError:
+            logger.warning("%s прервана: обработано %s из %s (доставлено %s)",
+                           title, stats.done, stats.total, stats.delivered)
+            raise
+        finally:
+            for w in [producer] + workers:
+                w.cancel()
+            if reporter:
+                reporter.cancel()
+
+        logger.info("%s: доставлено %s, заблокировано %s, удалено аккаунтов %s, ошибок %s из %s",
+                    title, stats.delivered, stats.blocked, stats.deactivated, stats.failed, stats.total)
+        if report_chat_id is not None:
+            await self._final_report(progress_msg, report_chat_id, stats)
+        return stats
+
+    async def wait_all(self, timeout=None):
+        """Ждёт запущенные рассылки; через timeout секунд недоделанные отменяются."""
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _produce(self, recipients, queue):
+        try:
+            if hasattr(recipients, "__aiter__"):
+                async for chat_id in recipients:
+                    await queue.put(chat_id)
+            else:
+                for chat_id in recipients:
+                    await queue.put(chat_id)
+        except Exception as e:
+            logger.warning("Рассылка прервана, не удалось прочитать получателей: %s", e)
+        # По одному None на воркера — сигнал, что получателей больше нет. При отмене
+        # сюда не доходим: воркеров отменяют вместе с нами, а ждать места в полной
+        # очереди, которую уже никто не читает, можно вечно
+        for _ in range(self.concurrency):
+            await queue.put(None)
+
+    async def _worker(self, queue, send, stats):
+        while True:
+            chat_id = await queue.get()
+            if chat_id is None:
+                return
+            result = await self._deliver(chat_id, send)
+            setattr(stats, result, getattr(stats, result) + 1)
+            if result in ("blocked", "deactivated") and self.on_undeliverable is not None:
+                self.on_undeliverable(chat_id, result)
+
+    async def _deliver(self, chat_id, send):
+        attempt = 0
+        while True:
+            await self.per_chat.wait(chat_id)
+            await self.bucket.acquire()
+            try:
+                await send(chat_id)
+                return "delivered"
+            except TelegramRetryAfter as e:
+                # 429: ждём столько, сколько просит Telegram, и не считаем это попыткой
+                self.bucket.pause(e.retry_after)
+                self.per_chat.pause(chat_id, e.retry_after)
+            except TelegramForbiddenError as e:
+                return "deactivated" if "deactivated" in str(e).lower() else "blocked"
+            except TelegramBadRequest as e:
+                logger.debug("Рассылка %s: %s", chat_id, e)
+                return "deactivated" if "chat not found" in str(e).lower() else "failed"
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.warning("Рассылка %s: %s", chat_id, e)
+                    return "failed"
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except Exception as e:
+                logger.warning("Рассылка %s: %s", chat_id, e)
+                return "failed"
+
+    async def _report_progress(self, msg, stats):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self._edit_progress(msg, stats)
+
+    async def _edit_progress(self, msg, stats):
+        # Промежуточный прогресс не страшно пропустить: следующий догонит
+        try:
+            await msg.edit_text(stats.summary(), parse_mode="HTML")
+        except Exception:
+            pass
+
+    async def _final_report(self, msg, chat_id, stats):
+        """Итог рассылки: правкой сообщения с прогрессом, а если его нет или правка не прошла — новым."""
+        text = "✅ Рассылка завершена.\n\n" + stats.summary()
+        if msg is not None:
+            try:
+                await self._with_retry_after(lambda: msg.edit_text(text, parse_mode="HTML"))
+                return
+            except Exception as e:
+                if "not modified" in str(e).lower():
+                    return
+                logger.warning("Не удалось обновить прогресс рассылки, отправляю итог отдельно: %s", e)
+        try:
+            await self._with_retry_after(lambda: self.bot.send_message(chat_id, text, parse_mode="HTML"))
+        except Exception as e:
+            logger.warning("Не удалось отправить итог рассылки: %s", e)
+
+    async def _with_retry_after(self, call):
+        # В админской группе лимит ~20 сообщений в минуту: на 429 ждём, сколько просит Telegram
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await call()
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(e.retry_after)
@@ -0,0 +1,115 @@
+import logging
+import time
+from collections import OrderedDict, deque
+
+from retrieval import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class Dialog:
+    __slots__ = ("summary", "turns", "tokens", "touched")
+
+    def __init__(self):
+        self.summary = ""
+        self.turns = deque()  # (role, text, tokens), старые слева
+        self.tokens = 0  # сумма по turns, без сводки
+        self.touched = time.monotonic()
+
+
+class DialogMemory:
+    """Недавняя переписка каждого пользователя с нейросетью.
+
+    На пользователя — очередь последних реплик не длиннее token_budget
+    токенов и max_turns реплик. Когда лимит превышен, старые реплики
+    сворачиваются в короткую сводку (summarize — обычно запрос к модели),
+    так что вопросы вроде «а когда это?» понимаются по контексту. Диалог,
+    к которому не возвращались ttl секунд, забывается. Всего хранится не
+    больше max_users диалогов: при переполнении выкидывается тот, к
+    которому дольше всех не обращались (LRU).
+    """
+
+    def __init__(self, summarize=None, max_users=5000, token_budget=600, max_turns=12, ttl=1800):
+        self.summarize = summarize  # async (summary, [(role, text), ...]) -> str
+        self.max_users = max_users
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self.summaries = 0
+        self._dialogs = OrderedDict()  # ключ (филиал, пользователь) -> Dialog
+
+    def __len__(self):
+        return len(self._dialogs)
+
+    def _get(self, key):
+        dialog = self._dialogs.get(key)
+        if dialog is None:
+            return None
+        if time.monotonic() - dialog.touched > self.ttl:
+            del self._dialogs[key]
+            return None
+        self._dialogs.move_to_end(key)
+        return dialog
+
+    def history(self, key):
+        """(сводка, [{"role", "content"}, ...]) — что добавить в запрос к модели перед новым вопросом."""
+        dialog = self._get(key)
+        if dialog is None:
+            return "", []
+        return dialog.summary, [{"role": role, "content": text} for role, text, _ in dialog.turns]
+
+    def add(self, key, question, answer):
+        dialog = self._get(key)
+        if dialog is None:
+            dialog = self._dialogs[key] = Dialog()
+            while len(self._dialogs) > self.max_users:
+                self._dialogs.popitem(last=False)
+        for role, text in (("user", question), ("assistant", answer)):
+            # Одна длинная реплика не должна занять весь бюджет
+            text = text[:self.token_budget * 3 // 2]
+            tokens = estimate_tokens(text)
+            dialog.turns.append((role, text, tokens))
+            dialog.tokens += tokens
+        dialog.touched = time.monotonic()
+
+    def reset(self, key):
+        return self._dialogs.pop(key, None) is not None
+
+    async def compact(self, key):
+        """Сворачивает старые реплики в сводку, если диалог вышел за лимиты."""
+        dialog = self._get(key)
+        if dialog is None or (dialog.tokens <= self.token_budget and len(dialog.turns) <= self.max_turns):
+            return
+        # Сворачиваем до половины бюджета, чтобы не звать модель после каждого вопроса
+        # (реплики добавляются парами вопрос-ответ, последняя пара остаётся как есть)
+        turns = list(dialog.turns)
+        folded = []
+        tokens, count = dialog.tokens, len(turns)
+        for i in range(0, len(turns) - 2, 2):
+            if tokens <= self.token_budget // 2 and count <= self.max_turns // 2:
+                break
+            pair = turns[i:i + 2]
+            folded += [(role, text) for role, text, _ in pair]
+            tokens -= sum(cost for _, _, cost in pair)
+            count -= len(pair)
+        if not folded:
+            return
+        summary = await self._summarize(dialog.summary, folded)
+        # Пока ждали модель, диалог могли сбросить
+        if self._dialogs.get(key) is not dialog:
+            return
+        for _ in folded:
+            _, _, cost = dialog.turns.popleft()
+            dialog.tokens -= cost
+        dialog.summary = summary[:self.token_budget]  # сводка — не больше трети бюджета
+        self.summaries += 1
+
+    async def _summarize(self, summary, turns):
+        if self.summarize is not None:
+            try:
+                return await self.summarize(summary, turns)
+            except Exception as e:
+                logger.warning("Не удалось сжать диалог, оставляю только вопросы: %s", e)
+        # Запасной вариант без модели: помним, о чём спрашивали
+        questions = [text[:80] for role, text in turns if role == "user"]
+        return "; ".join(filter(None, [summary, *questions]))[-self.token_budget:]
@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import os
+import uuid
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "events_changed"
+COLUMNS = "id, short_text, long_text, photo_id"
+_origin = (None, None)  # (pid, метка)
+
+
+def origin():
+    """Метка процесса в уведомлениях: свои же изменения кэш уже учёл.
+
+    Считается по pid: webhook-воркеры форкаются после импорта модуля, и общая
+    на всех метка заставила бы их принимать чужие изменения за свои.
+    """
+    global _origin
+    pid = os.getpid()
+    if _origin[0] != pid:
+        _origin = (pid, f"{pid}-{uuid.uuid4().hex}")
+    return _origin[1]
+
+
+@dataclass
+class EventsPage:
+    """Страница списка: записи (id, short_text), новые сверху, и курсоры для соседних страниц."""
+
+    items: list
+    newer: int = None  # id первой записи, если выше есть ещё
+    older: int = None  # id последней записи, если ниже есть ещё
+
+
+class EventsRepository:
+    """Актуальные мероприятия филиала в памяти процесса.
+
+    Чтения обслуживаются из кэша, запись идёт в БД и сразу обновляет кэш
+    (write-through). Если включён LISTEN/NOTIFY, другие процессы бота
+    сбрасывают свой кэш, когда кто-то меняет мероприятия этого филиала
+    (см. EventsListener).
+
+    В кэше только неархивные мероприятия, и их не больше active_limit:
+    при добавлении нового самые старые уходят в архив. Архив читается
+    из БД постранично (keyset по id), в память целиком не попадает.
+    """
+
+    def __init__(self, branch, notify=False, active_limit=30):
+        self.branch = branch
+        self.notify = notify
+        self.active_limit = active_limit
+        self.hits = 0
+        self.misses = 0
+        self._events = None  # список записей, новые сверху
+        self._by_id = {}
+        self._version = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def version(self):
+        """Растёт при каждом изменении мероприятий — по нему зависимые кэши понимают, что пора обновиться."""
+        return self._version
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "cached": len(self._by_id) if self._events is not None else 0}
+
+    def invalidate(self):
+        self._version += 1
+        self._events = None
+        self._by_id = {}
+
+    def _set(self, events):
+        self._events = list(events)
+        self._by_id = {e['id']: e for e in self._events}
+
+    async def _load(self, pool):
+        async with self._lock:
+            if self._events is not None:
+                return
+            version = self._version
+            async with pool.acquire() as conn:
+                rows = await conn.fetch(
+                    f"SELECT {COLUMNS} FROM events WHERE branch_id = $1 AND NOT archived ORDER BY id DESC", self.branch
+                )
+            # Если пока мы читали, кэш успели сбросить, — эти данные уже устарели
+            if version == self._version:
+                self._set(rows)
+
+    async def all(self, pool):
+        if self._events is not None:
+            self.hits += 1
+            return self._events
+        self.misses += 1
+        await self._load(pool)
+        if self._events is None:
+            async with pool.acquire() as conn:
+                return await conn.fetch(
+                    f"SELECT {COLUMNS} FROM events WHERE branch_id = $1 AND NOT archived ORDER BY id DESC", self.branch
+                )
+        return self._events
+
+    async def get(self, pool, event_id):
+        if self._events is not None:
+            self.hits += 1
+        else:
+            await self.all(pool)
+        event = self._by_id.get(event_id)
+        if event is None:
+            # Архивного мероприятия в кэше нет — читаем одну запись
+            async with pool.acquire() as conn:
+                event = await conn.fetchrow(
+                    f"SELECT {COLUMNS} FROM events WHERE id = $1 AND branch_id = $2", event_id, self.branch
+                )
+        return event
+
+    async def page(self, pool, archived=False, before=None, after=None, limit=8):
+        """Страница заголовков, новые сверху: before — старее этого id, after — новее."""
+        if not archived:
+            events = await self.all(pool)
+            if after is not None:
+                newer = [e for e in events if e['id'] > after]
+                items = newer[-limit:]
+            else:
+                items = [e for e in events if before is None or e['id'] < before][:limit]
+            if not items and (before is not None or after is not None):
+                return await self.page(pool, archived, limit=limit)
+            first, last = (items[0]['id'], items[-1]['id']) if items else (None, None)
+            return EventsPage(
+                items=[{"id": e['id'], "short_text": e['short_text']} for e in items],
+                newer=first if items and events[0]['id'] > first else None,
+                older=last if items and events[-1]['id'] < last else None,
+            )
+
+        # Архив: keyset по id, берём на одну запись больше, чтобы знать, есть ли следующая страница
+        async with pool.acquire() as conn:
+            if after is not None:
+                rows = await conn.fetch(
+                    "SELECT id, short_text FROM events WHERE branch_id = $1 AND archived AND id > $2 "
+                    "ORDER BY id ASC LIMIT $3",
+                    self.branch, after, limit + 1,
+                )
+                more, rows = len(rows) > limit, list(reversed(rows[:limit]))
+                has_newer, has_older = more, True
+            elif before is not None:
+                rows = await conn.fetch(
+                    "SELECT id, short_text FROM events WHERE branch_id = $1 AND archived AND id < $2 "
+                    "ORDER BY id DESC LIMIT $3",
+                    self.branch, before, limit + 1,
+                )
+                has_newer, has_older, rows = True, len(rows) > limit, rows[:limit]
+            else:
+                rows = await conn.fetch(
+                    "SELECT id, short_text FROM events WHERE branch_id = $1 AND archived ORDER BY id DESC LIMIT $2",
+                    self.branch, limit + 1,
+                )
+                has_newer, has_older, rows = False, len(rows) > limit, rows[:limit]
+        if not rows:
+            if before is not None or after is not None:
+                # Соседнюю страницу успели удалить — начинаем сначала
+                return await self.page(pool, archived, limit=limit)
+            return EventsPage(items=[])
+        return EventsPage(
+            items=list(rows),
+            newer=rows[0]['id'] if has_newer else None,
+            older=rows[-1]['id'] if has_older else None,
+        )
+
+    async def add(self, pool, short_text, long_text, photo_id):
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow(
+                    f"INSERT INTO events (branch_id, short_text, long_text, photo_id) VALUES ($1, $2, $3, $4) "
+                    f"RETURNING {COLUMNS}",
+                    self.branch, short_text, long_text, photo_id,
+                )
+                # Самые старые из актуальных уходят в архив, чтобы список и кэш не росли
+                archived = await conn.fetch(
+                    "UPDATE events SET archived = true WHERE id IN "
+                    "(SELECT id FROM events WHERE branch_id = $1 AND NOT archived ORDER BY id DESC OFFSET $2) RETURNING id",
+                    self.branch, self.active_limit,
+                )
+                await self._notify(conn, "add")
+        self._version += 1
+        if self._events is not None:
+            gone = {r['id'] for r in archived}
+            self._set([row] + [e for e in self._events if e['id'] not in gone])
+        return row
+
+    async def archive(self, pool, event_id):
+        async with pool.acquire() as conn:
+            await conn.execute("UPDATE events SET archived = true WHERE id = $1 AND branch_id = $2", event_id, self.branch)
+            await self._notify(conn, "archive")
+        self._version += 1
+        if self._events is not None:
+            self._set([e for e in self._events if e['id'] != event_id])
+
+    async def delete(self, pool, event_id):
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM events WHERE id = $1 AND branch_id = $2", event_id, self.branch)
+            await self._notify(conn, "delete")
+        self._version += 1
+        if self._events is not None:
+            self._set([e for e in self._events if e['id'] != event_id])
+
+    async def _notify(self, conn, action):
+        if self.notify:
+            await conn.execute("SELECT pg_notify($1, $2)", NOTIFY_CHANNEL, f"{origin()}:{self.branch}:{action}")
+
+
+class EventsListener:
+    """Одно соединение с LISTEN на все филиалы процесса.
+
+    Уведомление от другого процесса сбрасывает кэш только того филиала,
+    чьи мероприятия изменились.
+    """
+
+    def __init__(self):
+        self._repos = {}  # branch -> EventsRepository
+        self._conn = None
+
+    def add(self, repo):
+        self._repos[repo.branch] = repo
+
+    async def listen(self, pool):
+        if self._conn is not None or not any(r.notify for r in self._repos.values()):
+            return
+        self._conn = await pool.acquire()
+        await self._conn.add_listener(NOTIFY_CHANNEL, self._on_notify)
+
+    def _on_notify(self, conn, pid, channel, payload):
+        sender, branch, _ = payload.split(":", 2)
+        repo = self._repos.get(branch)
+        if sender == origin() or repo is None:
+            return
+        logger.info("Мероприятия филиала %s изменены другим процессом, сбрасываю кэш", branch)
+        repo.invalidate()
+
+    async def close(self, pool):
+        if self._conn is not None:
+            await self._conn.remove_listener(NOTIFY_CHANNEL, self._on_notify)
+            await pool.release(self._conn)
+            self._conn = None
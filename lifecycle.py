@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import os
+import time
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+def _process_age():
+    """Сколько секунд назад запущен процесс (по /proc), 0 — если узнать нельзя."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class Lifecycle(BaseMiddleware):
+    """Готовность процесса и учёт апдейтов в обработке.
+
+    Внешний middleware на dp.update: считает апдейты, которые сейчас
+    обрабатываются, и пишет в лог, через сколько после запуска процесса
+    пришёл первый. /healthz отвечает, пока процесс жив, /readyz — только
+    между mark_ready() и началом остановки. drain() перестаёт объявлять
+    готовность и ждёт, пока доработают начатые хендлеры.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic() - _process_age()
+        self.ready = False
+        self.in_flight = 0
+        self.first_update = None  # сек. от запуска до первого апдейта
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def uptime(self):
+        return time.monotonic() - self.started
+
+    def mark_ready(self):
+        self.ready = True
+        logger.info("Бот готов через %.2f сек. после запуска", self.uptime())
+
+    async def __call__(self, handler, event, data):
+        if self.first_update is None:
+            self.first_update = self.uptime()
+            logger.info("Первый апдейт через %.2f сек. после запуска", self.first_update)
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+            if not self.in_flight:
+                self._idle.set()
+
+    async def drain(self, timeout):
+        self.ready = False
+        if not self.in_flight:
+            return
+        logger.info("Жду завершения %s апдейтов (до %s сек.)", self.in_flight, timeout)
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Не дождались %s апдейтов, останавливаюсь", self.in_flight)
+
+    def add_routes(self, app):
+        async def health(request):
+            return web.Response(text="ok")
+
+        async def ready(request):
+            if self.ready:
+                return web.Response(text="ready")
+            return web.Response(text="not ready", status=503)
+
+        app.router.add_get("/healthz", health)
+        app.router.add_get("/readyz", ready)
+        return app
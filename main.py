@@ -1,20 +1,142 @@
 import os
 import asyncio
+import html
 import logging
 import random
+import secrets
 from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
-from gigachat import GigaChat
+from aiogram.types import BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton
 import asyncpg
 
+from ai_client import AIClient
+from answer_cache import AnswerCache
+from backlog import BacklogDrainer
+from branches import DEFAULT_BRANCH, Branch, Branches, load_from_db, load_from_dir
+from broadcast import Broadcaster
+from dialogs import DialogMemory
+from events_cache import EventsListener, EventsRepository
+import metrics
+from lifecycle import Lifecycle
+from media import MediaRegistry
+from migrations import migrate
+from outbox import AdminOutbox
+from pg_storage import PgStorage
+from ratelimit import GroupRetryAfter
+from registration import UserRegistry
+from retrieval import KnowledgeBase, stuff_prompt
+from screens import ScreenRenderer
+from streaming import ProgressiveReply, send_long
+from throttling import ThrottlingMiddleware
+from webhook import build_app, run_workers, serve
+
 # --- НАСТРОЙКИ ---
 TOKEN = os.getenv("BOT_TOKEN")
 GIGACHAT_KEY = os.getenv("GIGACHAT_KEY")
-ADMIN_GROUP_ID = int(os.getenv("ADMIN_GROUP_ID"))
+GIGACHAT_MODEL = os.getenv("GIGACHAT_MODEL", "GigaChat")  # новые версии библиотеки gigachat не выбирают модель сами
+ADMIN_GROUP_ID = int(os.getenv("ADMIN_GROUP_ID") or 0)  # без него админка выключена, заявки копятся в БД
+# Филиалы: пусто — один бот из BOT_TOKEN и ADMIN_GROUP_ID; db — из таблицы branches;
+# иначе путь к каталогу с JSON-файлами филиалов (id, token, admin_chat_id, prompt_file, texts, files)
+BRANCHES = os.getenv("BRANCHES", "")
 DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "10"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# Остановка: сколько секунд ждать хендлеры, которые уже начали работу, и затем — идущие рассылки
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "30"))
+# Апдейты, пришедшие, пока бот был выключен: drain — разобрать при запуске (BACKLOG_WORKERS чатов
+# параллельно, внутри чата по порядку, в темпе лимитов рассылки BROADCAST_*), drop — выбросить, как раньше
+PENDING_UPDATES = os.getenv("PENDING_UPDATES", "drain")
+BACKLOG_WORKERS = int(os.getenv("BACKLOG_WORKERS", "16"))
+# Картинки меню и календарь при старте загружаются в этот служебный чат (и сразу удаляются),
+# чтобы первый пользователь не ждал загрузки файла. Пусто — загружать при первом показе.
+MEDIA_UPLOAD_CHAT_ID = int(os.getenv("MEDIA_UPLOAD_CHAT_ID") or 0)
+STATIC_MEDIA = ["img/main.jpg", "img/main2.jpg", "img/projects.jpg", "img/team.jpg", "img/activities.jpg",
+                "img/contacts.jpg", "docs/calendar.pdf"]
+
+# Адреса API: по умолчанию настоящие, для нагрузочных тестов (bench/loadtest.py) — локальные заглушки
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# HTTP-соединений к Bot API на отправку сообщений всеми ботами (в polling к ним добавляется по одному
+# на каждого бота под getUpdates)
+TELEGRAM_CONNECTIONS = int(os.getenv("TELEGRAM_CONNECTIONS", "100"))
+GIGACHAT_BASE_URL = os.getenv("GIGACHAT_BASE_URL")
+GIGACHAT_AUTH_URL = os.getenv("GIGACHAT_AUTH_URL")
+
+# Режим работы: polling (по умолчанию, для разработки) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес, например https://bot.example.ru/webhook
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # если не задан, генерируется при каждом запуске
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))  # при >1 включите и EVENTS_NOTIFY=1
+
+# Метрики Prometheus на локальном порту (у каждого webhook-воркера свой: METRICS_PORT + номер), 0 — выключить
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Рассылки: общий лимит Telegram ~30 сообщений/сек, в один чат — не чаще раза в секунду
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CHAT_INTERVAL = float(os.getenv("BROADCAST_CHAT_INTERVAL", "1.0"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_RETRIES = int(os.getenv("BROADCAST_RETRIES", "3"))
+# Получатели читаются из БД пачками по мере отправки; заблокировавшие бота пропускаются
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", "1000"))
+
+# Нейросеть: сколько запросов к GigaChat выполняется одновременно, остальные ждут в очереди
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "4"))
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "60"))
+# Потоковый ответ: сообщение «Думаю...» дописывается не чаще раза в AI_EDIT_INTERVAL сек.
+AI_STREAMING = os.getenv("AI_STREAMING", "1") == "1"
+AI_EDIT_INTERVAL = float(os.getenv("AI_EDIT_INTERVAL", "1.0"))
+AI_EDIT_MIN_CHARS = int(os.getenv("AI_EDIT_MIN_CHARS", "60"))
+# В промпт идут только относящиеся к вопросу куски базы знаний и мероприятий (AI_RETRIEVAL=0 — всё целиком)
+AI_RETRIEVAL = os.getenv("AI_RETRIEVAL", "1") == "1"
+AI_TOP_K = int(os.getenv("AI_TOP_K", "8"))
+AI_PROMPT_BUDGET = int(os.getenv("AI_PROMPT_BUDGET", "1200"))
+# Кэш ответов на частые вопросы; сбрасывается при любом изменении мероприятий
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "500"))
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", "3600"))
+AI_CACHE_FUZZY = os.getenv("AI_CACHE_FUZZY", "1") == "1"
+AI_CACHE_THRESHOLD = float(os.getenv("AI_CACHE_THRESHOLD", "0.8"))
+# Память диалога: последние реплики (до AI_MEMORY_TOKENS токенов), старые сворачиваются в сводку.
+# Диалог забывается через AI_MEMORY_TTL сек. тишины; всего помним не больше AI_MEMORY_USERS диалогов.
+AI_MEMORY_TOKENS = int(os.getenv("AI_MEMORY_TOKENS", "600"))
+AI_MEMORY_TURNS = int(os.getenv("AI_MEMORY_TURNS", "12"))
+AI_MEMORY_TTL = int(os.getenv("AI_MEMORY_TTL", "1800"))
+AI_MEMORY_USERS = int(os.getenv("AI_MEMORY_USERS", "5000"))
+
+# Кэш мероприятий: при нескольких процессах бота включите EVENTS_NOTIFY=1 (LISTEN/NOTIFY в Postgres)
+EVENTS_NOTIFY = os.getenv("EVENTS_NOTIFY", "0") == "1"
+# Списки мероприятий выводятся страницами; актуальных не больше EVENTS_ACTIVE_LIMIT, старые уходят в архив
+EVENTS_PAGE_SIZE = int(os.getenv("EVENTS_PAGE_SIZE", "8"))
+EVENTS_ACTIVE_LIMIT = int(os.getenv("EVENTS_ACTIVE_LIMIT", "30"))
+
+# Новые пользователи пишутся в БД пачками: по размеру буфера или раз в N секунд
+USERS_BATCH_SIZE = int(os.getenv("USERS_BATCH_SIZE", "200"))
+USERS_FLUSH_INTERVAL = float(os.getenv("USERS_FLUSH_INTERVAL", "5"))
+
+# Антиспам: токены на пользователя в секунду (меню/анкеты и вопросы ИИ отдельно) и общий лимит ИИ на бота
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "2"))
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", "5"))
+AI_USER_RATE = float(os.getenv("AI_USER_RATE", "0.1"))
+AI_USER_BURST = int(os.getenv("AI_USER_BURST", "3"))
+AI_GLOBAL_RATE = float(os.getenv("AI_GLOBAL_RATE", "2"))
+AI_GLOBAL_BURST = int(os.getenv("AI_GLOBAL_BURST", "10"))
+
+# Состояния анкет хранятся в Postgres. Брошенные анкеты удаляются через FSM_TTL секунд.
+# LRU-кэш состояний безопасен только в одном процессе, поэтому с воркерами он выключен.
+FSM_TTL = int(os.getenv("FSM_TTL", "86400"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "1000"))
+FSM_CACHE_SECONDS = float(os.getenv("FSM_CACHE_SECONDS", "300" if WEBHOOK_WORKERS <= 1 else "0"))
+
+# Заявки и идеи сначала пишутся в таблицу admin_outbox, в админскую группу уходят фоном:
+# не чаще ADMIN_RATE_PER_MIN сообщений в минуту, накопившиеся — одной сводкой до ADMIN_DIGEST_MAX штук
+ADMIN_RATE_PER_MIN = float(os.getenv("ADMIN_RATE_PER_MIN", "20"))
+ADMIN_DIGEST_MAX = int(os.getenv("ADMIN_DIGEST_MAX", "10"))
 
 # --- БАЗА ЗНАНИЙ (ОБНОВЛЕННАЯ И ПОЛНАЯ) ---
 BASE_SYSTEM_PROMPT = """
@@ -53,36 +175,139 @@ BASE_SYSTEM_PROMPT = """
 - Ценности (11 штук): Жизнь и достоинство, Патриотизм, Дружба, Добро и справедливость, Мечта, Созидательный труд, Взаимопомощь, Единство народов, Историческая память, Служение Отечеству, Крепкая семья.
 """
 
+# --- ТЕКСТЫ ЭКРАНОВ ---
+# Филиал может переопределить любой из них в своих настройках (texts)
+TEXTS = {
+    "start": (
+        "👋 <b>Привет!</b>\n"
+        "Я — цифровой навигатор первичного отделения <b>МБОУ СОШ №9 г. Брянска</b>.\n\n"
+        "Я здесь, чтобы помочь тебе сориентироваться в событиях и проектах Движения Первых.\n"
+        "Подскажу, где найти информацию, напомню о дедлайнах и просто поболтаю!\n\n"
+        "👨‍💻 <i>Разработал:</i> общественный организатор Артём Карпов @temhdg\n"
+        "Поехали? 👇"
+    ),
+    "main_menu": "Главное меню. Выбери раздел: 👇",
+    "sections": "📂 <b>Меню разделов:</b>\nВыбери, что тебя интересует:",
+    "sec_about_movement": (
+        "🚀 <b>Что такое Движение Первых?</b>\n\n"
+        "Движение Первых – единственная общественная организация в стране, где дети и взрослые остаются равноправными участниками. "
+        "Это особое пространство для диалога детей, родителей, педагогов и наставников.\n\n"
+        "📌 <b>Миссия Движения:</b>\n"
+        "✅ Быть с Россией\n✅ Быть человеком\n✅ Быть вместе\n✅ Быть в движении\n✅ Быть Первыми\n\n"
+        "❤️ <b>Ценности:</b> Жизнь, Патриотизм, Дружба, Добро, Мечта, Труд.\n\n"
+        "<a href='https://будьвдвижении.рф/mission-values/'>🔗 Подробнее на сайте</a>"
+    ),
+    "sec_how_to_join": (
+        "📝 <b>Как вступить в Движение Первых?</b>\n\n"
+        "1️⃣ Зайди на сайт <a href='https://id.pervye.ru/ref/department/19889'>id.pervye.ru</a>\n"
+        "2️⃣ Нажми кнопку <b>Зарегистрироваться</b>.\n"
+        "3️⃣ <b>Важно!</b> Правильно введи личные данные: ФИО, возраст, место проживания, город, школу, почту.\n"
+        "4️⃣ <b>Прикрепись к первичке:</b> Нажми кнопку «Мое первичное отделение», в списке выбери <b>МБОУ СОШ №9 г. Брянск</b> и нажми «Сохранить».\n\n"
+        "Готово! Ты в команде! 🎉"
+    ),
+    "sec_projects": (
+        "💡 <b>Проекты Движения</b>\n\n"
+        "Со всеми проектами можно ознакомиться на официальном сайте: <a href='https://projects.pervye.ru'>projects.pervye.ru</a>\n\n"
+        "Там ты найдешь конкурсы, гранты и активности!"
+    ),
+    "sec_our_branch": (
+        "🏫 <b>Наше Первичное отделение</b>\n\n"
+        "Всем привет! Мы первичное отделение <b>МБОУ СОШ №9 г. Брянска</b>.\n"
+        "Мы утверждаем: неуспешных детей нет. Успеха может добиться каждый!\n\n"
+        "<b>Наша команда:</b>\n"
+        "👤 <b>Куратор:</b> Седакова Елена Геннадьевна\n"
+        "👤 <b>Председатель Совета:</b> Алексеенкова Дарья\n"
+        "👤 <b>Наставник:</b> Межуева Алина Олеговна\n\n"
+        "Добивайся успеха вместе с нами!"
+    ),
+    "sec_activities": (
+        "📢 <b>Деятельность первичного отделения</b>\n\n"
+        "<b>Наши основные направления:</b>\n"
+        "🇷🇺 <b>Патриотизм:</b> Акция «Окна Победы», квесты.\n"
+        "❤️ <b>Волонтерство:</b> Социальные акции, помощь нуждающимся.\n"
+        "⚽ <b>Спорт и ЗОЖ:</b> Спортивные мероприятия.\n"
+        "🧠 <b>Образование:</b> Квизы, мастер-классы, встречи с профи.\n"
+        "🎤 <b>Культура и медиа:</b> Творческие проекты, школьное радио «Девяточка»."
+    ),
+    "sec_contacts": (
+        "📞 <b>Наши контакты</b>\n\n"
+        "📲 <b>Группа Первички:</b> <a href='https://vk.ru/pervyedevyatochki'>vk.ru/pervyedevyatochki</a>\n"
+        "🏫 <b>Школьная группа:</b> <a href='https://vk.ru/sch9bryansk'>vk.ru/sch9bryansk</a>\n\n"
+        "👤 <b>Седакова Елена Геннадьевна:</b> @ElenaSedakovaSCH9\n"
+        "👤 <b>Межуева Алина Олеговна:</b> @a_kzlva\n\n"
+        "🔗 <b>Канал MAX:</b> <a href='https://max.ru/id3234036720_gos'>Перейти</a>"
+    ),
+    "ask_ai": "🤖 <b>Я на связи!</b>\nНапиши мне любой вопрос про школу, Движение или наши мероприятия.",
+}
+
 # --- БАЗА ДАННЫХ ---
+events_listener = EventsListener()
+
+# Схема БД: новые изменения — только новой версией в конце списка. IF NOT EXISTS в первых версиях
+# нужен базам, созданным ещё до появления миграций.
+MIGRATIONS = [
+    (1, "начальная схема", [
+        "CREATE TABLE IF NOT EXISTS users (user_id BIGINT PRIMARY KEY, username TEXT)",
+        "CREATE TABLE IF NOT EXISTS events (id SERIAL PRIMARY KEY, short_text TEXT, long_text TEXT, photo_id TEXT)",
+        "CREATE TABLE IF NOT EXISTS media_files (path TEXT PRIMARY KEY, content_hash TEXT, file_id TEXT)",
+        "CREATE TABLE IF NOT EXISTS fsm_storage (key TEXT PRIMARY KEY, state TEXT, data JSONB NOT NULL DEFAULT '{}'::jsonb, updated_at TIMESTAMPTZ NOT NULL DEFAULT now())",
+    ]),
+    (2, "архив мероприятий", [
+        "ALTER TABLE events ADD COLUMN IF NOT EXISTS archived BOOLEAN NOT NULL DEFAULT false",
+        "CREATE INDEX IF NOT EXISTS events_active_id_idx ON events (id DESC) WHERE NOT archived",
+    ]),
+    (3, "статус пользователя для рассылок", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'active'",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS last_error_at TIMESTAMPTZ",
+        "CREATE INDEX IF NOT EXISTS users_active_idx ON users (user_id) WHERE status = 'active'",
+    ]),
+    (4, "очередь уведомлений админам", [
+        "CREATE TABLE IF NOT EXISTS admin_outbox (id BIGSERIAL PRIMARY KEY, chat_id BIGINT NOT NULL, kind TEXT NOT NULL, text TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending', attempts INT NOT NULL DEFAULT 0, last_error TEXT, created_at TIMESTAMPTZ NOT NULL DEFAULT now(), next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(), sent_at TIMESTAMPTZ)",
+        "CREATE INDEX IF NOT EXISTS admin_outbox_pending_idx ON admin_outbox (id) WHERE status = 'pending'",
+    ]),
+    (5, "филиалы", [
+        "CREATE TABLE branches (id TEXT PRIMARY KEY, token TEXT NOT NULL, admin_chat_id BIGINT NOT NULL DEFAULT 0, config JSONB NOT NULL DEFAULT '{}'::jsonb, enabled BOOLEAN NOT NULL DEFAULT true)",
+        f"ALTER TABLE users ADD COLUMN branch_id TEXT NOT NULL DEFAULT '{DEFAULT_BRANCH}'",
+        "ALTER TABLE users DROP CONSTRAINT users_pkey, ADD PRIMARY KEY (branch_id, user_id)",
+        "DROP INDEX users_active_idx",
+        "CREATE INDEX users_active_idx ON users (branch_id, user_id) WHERE status = 'active'",
+        f"ALTER TABLE events ADD COLUMN branch_id TEXT NOT NULL DEFAULT '{DEFAULT_BRANCH}'",
+        "DROP INDEX events_active_id_idx",
+        "CREATE INDEX events_active_id_idx ON events (branch_id, id DESC) WHERE NOT archived",
+        "CREATE INDEX events_archived_id_idx ON events (branch_id, id DESC) WHERE archived",
+        f"ALTER TABLE media_files ADD COLUMN branch_id TEXT NOT NULL DEFAULT '{DEFAULT_BRANCH}'",
+        "ALTER TABLE media_files DROP CONSTRAINT media_files_pkey, ADD PRIMARY KEY (branch_id, path)",
+        f"ALTER TABLE admin_outbox ADD COLUMN branch_id TEXT NOT NULL DEFAULT '{DEFAULT_BRANCH}'",
+    ]),
+]
+
 async def create_tables(pool):
-    async with pool.acquire() as conn:
-        await conn.execute("CREATE TABLE IF NOT EXISTS users (user_id BIGINT PRIMARY KEY, username TEXT)")
-        await conn.execute("CREATE TABLE IF NOT EXISTS events (id SERIAL PRIMARY KEY, short_text TEXT, long_text TEXT, photo_id TEXT)")
+    await migrate(pool, MIGRATIONS)
+
+# Получатели рассылки филиала: сколько их и async-итератор по активным (реестр держит свой пул)
+async def get_recipients(branch):
+    await branch.users.flush()
+    return branch.users.recipients(batch_size=BROADCAST_BATCH), await branch.users.count_active()
 
-async def add_user(pool, user_id, username):
-    async with pool.acquire() as conn:
-        await conn.execute("INSERT INTO users (user_id, username) VALUES ($1, $2) ON CONFLICT (user_id) DO NOTHING", user_id, username)
+# Мероприятия филиала читаются из кэша в памяти, запись сразу обновляет кэш
+async def add_event_db(branch, pool, short_text, long_text, photo_id):
+    return await branch.events.add(pool, short_text, long_text, photo_id)
 
-async def get_all_users(pool):
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT user_id FROM users")
-        return [row['user_id'] for row in rows]
+async def get_events_db(branch, pool):
+    return await branch.events.all(pool)
 
-async def add_event_db(pool, short_text, long_text, photo_id):
-    async with pool.acquire() as conn:
-        await conn.execute("INSERT INTO events (short_text, long_text, photo_id) VALUES ($1, $2, $3)", short_text, long_text, photo_id)
+async def get_event_by_id(branch, pool, event_id):
+    return await branch.events.get(pool, event_id)
 
-async def get_events_db(pool):
-    async with pool.acquire() as conn:
-        return await conn.fetch("SELECT * FROM events ORDER BY id DESC")
+async def delete_event_db(branch, pool, event_id):
+    await branch.events.delete(pool, event_id)
 
-async def get_event_by_id(pool, event_id):
-    async with pool.acquire() as conn:
-        return await conn.fetchrow("SELECT * FROM events WHERE id = $1", event_id)
+async def archive_event_db(branch, pool, event_id):
+    await branch.events.archive(pool, event_id)
 
-async def delete_event_db(pool, event_id):
-    async with pool.acquire() as conn:
-        await conn.execute("DELETE FROM events WHERE id = $1", event_id)
+# Страница заголовков: before — старее этого id, after — новее (курсор приходит в callback_data)
+async def get_events_page(branch, pool, archived=False, before=None, after=None):
+    return await branch.events.page(pool, archived=archived, before=before, after=after, limit=EVENTS_PAGE_SIZE)
 
 # --- FSM (СОСТОЯНИЯ) ---
 class AdminEvent(StatesGroup):
@@ -105,9 +330,123 @@ class IdeaState(StatesGroup):
     waiting_for_text = State()
 
 # --- ИНИЦИАЛИЗАЦИЯ ---
-bot = Bot(token=TOKEN)
-dp = Dispatcher()
+# Одна HTTP-сессия к Bot API на ботов всех филиалов; создаётся в load_branches, когда известно число ботов
+api_server = TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else None
+api_session = None
+storage = PgStorage(ttl=FSM_TTL, cache_size=FSM_CACHE_SIZE, cache_seconds=FSM_CACHE_SECONDS)
+dp = Dispatcher(storage=storage)
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+lifecycle = Lifecycle()
+dp.update.outer_middleware(lifecycle)
+branches = Branches()
+dp.update.outer_middleware(branches)
+handler_metrics = metrics.HandlerMetricsMiddleware()
+dp.message.middleware(handler_metrics)
+dp.callback_query.middleware(handler_metrics)
+throttling = ThrottlingMiddleware(
+    rate=THROTTLE_RATE,
+    burst=THROTTLE_BURST,
+    ai_rate=AI_USER_RATE,
+    ai_burst=AI_USER_BURST,
+    global_ai_rate=AI_GLOBAL_RATE,
+    global_ai_burst=AI_GLOBAL_BURST,
+)
+dp.message.middleware(throttling)
+dp.callback_query.middleware(throttling)
+admin_outbox = AdminOutbox(branches.bot, rate=ADMIN_RATE_PER_MIN / 60, max_batch=ADMIN_DIGEST_MAX)
+backlog = BacklogDrainer(dp, workers=BACKLOG_WORKERS, rate=BROADCAST_RATE, chat_interval=BROADCAST_CHAT_INTERVAL)
+ai_client = AIClient(
+    GIGACHAT_KEY,
+    model=GIGACHAT_MODEL,
+    max_concurrency=AI_MAX_CONCURRENCY,
+    timeout=AI_TIMEOUT,
+    base_url=GIGACHAT_BASE_URL,
+    auth_url=GIGACHAT_AUTH_URL,
+)
+
+SUMMARY_PROMPT = (
+    "Сожми переписку школьника с ботом школьной первички Движения Первых в 2-3 предложения: "
+    "о чём спрашивал и что ему ответили. Только факты, без вступлений."
+)
+
+async def summarize_dialog(summary, turns):
+    lines = [f"Ранее: {summary}"] if summary else []
+    lines += [f"{'Ученик' if role == 'user' else 'Бот'}: {text}" for role, text in turns]
+    return await ai_client.chat([
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": "\n".join(lines)},
+    ])
+
+dialogs = DialogMemory(
+    summarize_dialog,
+    max_users=AI_MEMORY_USERS,
+    token_budget=AI_MEMORY_TOKENS,
+    max_turns=AI_MEMORY_TURNS,
+    ttl=AI_MEMORY_TTL,
+)
+
+# Объекты одного филиала: бот (на общей сессии), кэши, реестры и рассылки.
+# Пул, диспетчер, хранилище анкет и GigaChat — общие на все филиалы.
+def setup_branch(branch):
+    branch.texts = {**TEXTS, **branch.texts}
+    branch.bot = Bot(token=branch.token, session=api_session)
+    branch.events = EventsRepository(branch.id, notify=EVENTS_NOTIFY, active_limit=EVENTS_ACTIVE_LIMIT)
+    events_listener.add(branch.events)
+    branch.users = UserRegistry(branch.id, batch_size=USERS_BATCH_SIZE, flush_interval=USERS_FLUSH_INTERVAL)
+    branch.media = MediaRegistry(branch.id)
+    branch.screens = ScreenRenderer(branch.media)
+    branch.knowledge = KnowledgeBase(branch.prompt or BASE_SYSTEM_PROMPT, top_k=AI_TOP_K, token_budget=AI_PROMPT_BUDGET)
+    branch.answers = AnswerCache(max_size=AI_CACHE_SIZE, ttl=AI_CACHE_TTL, fuzzy=AI_CACHE_FUZZY, threshold=AI_CACHE_THRESHOLD)
+    branch.broadcaster = Broadcaster(
+        branch.bot,
+        rate=BROADCAST_RATE,
+        per_chat_interval=BROADCAST_CHAT_INTERVAL,
+        concurrency=BROADCAST_CONCURRENCY,
+        max_retries=BROADCAST_RETRIES,
+        on_undeliverable=branch.users.mark,
+    )
+    if not branch.admin_chat_id:
+        logger.warning("Филиал %s: админский чат не задан, админка выключена, "
+                       "заявки ждут в admin_outbox, пока его не укажут", branch.id)
+    branches.add(branch)
+
+async def load_branches(pool):
+    if BRANCHES == "db":
+        configs = await load_from_db(pool)
+    elif BRANCHES:
+        configs = load_from_dir(BRANCHES)
+    else:
+        configs = [Branch(DEFAULT_BRANCH, TOKEN, ADMIN_GROUP_ID, media_upload_chat_id=MEDIA_UPLOAD_CHAT_ID)]
+    global api_session
+    if api_session is None:
+        # В polling каждый бот постоянно держит одно соединение под getUpdates: их добавляем сверху,
+        # иначе при сотне филиалов long-poll займёт все слоты и отправка сообщений встанет в очередь
+        polling = len(configs) if BOT_MODE == "polling" else 0
+        api_session = AiohttpSession(limit=polling + TELEGRAM_CONNECTIONS, **({"api": api_server} if api_server else {}))
+        # Повтор снаружи метрик: каждый ответ 429 попадает в bot_api_retry_after
+        api_session.middleware(GroupRetryAfter())
+        api_session.middleware(metrics.BotApiMetrics())
+    for branch in configs:
+        if branches.get(branch.id) is None:
+            setup_branch(branch)
+    logger.info("Филиалов: %s", len(branches))
+
+metrics.Gauge("bot_cache_hits", "Попадания в кэши", ("cache",), fn=lambda: {
+    ("events",): sum(b.events.hits for b in branches), ("answers",): sum(b.answers.hits for b in branches),
+    ("fsm",): storage.hits})
+metrics.Gauge("bot_cache_misses", "Промахи кэшей", ("cache",), fn=lambda: {
+    ("events",): sum(b.events.misses for b in branches), ("answers",): sum(b.answers.misses for b in branches),
+    ("fsm",): storage.misses})
+metrics.Gauge("bot_fsm_storage_ms", "Задержка FSM storage в Postgres", ("op", "stat"), fn=lambda: {
+    (op, stat): value for op, s in storage.timings.snapshot().items() for stat, value in s.items()})
+metrics.Gauge("bot_throttled", "Запросы, отклонённые лимитами или заменённые новыми", ("reason",), fn=lambda: {
+    ("rejected",): throttling.rejected, ("superseded",): throttling.superseded})
+metrics.Gauge("bot_ai_queue", "Запросы к GigaChat, ждущие своей очереди", fn=lambda: {(): ai_client.waiting})
+metrics.Gauge("bot_backlog", "Очередь апдейтов, разобранная после перезапуска", ("stat",), fn=lambda: {
+    ("pending",): backlog.pending, ("handled",): backlog.total, ("stale_callbacks",): backlog.stale_callbacks,
+    ("errors",): backlog.errors, ("seconds",): backlog.seconds})
+metrics.Gauge("bot_ai_dialogs", "Диалоги с нейросетью в памяти", fn=lambda: {(): len(dialogs)})
 
 # --- КЛАВИАТУРЫ ---
 
@@ -135,169 +474,104 @@ def sections_kb():
 def back_kb(to="main_menu", text="🔙 Назад"):
     return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=text, callback_data=to)]])
 
+def ask_ai_kb():
+    kb = [
+        [InlineKeyboardButton(text="🧹 Начать разговор заново", callback_data="ai_reset")],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu")]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
 def cancel_kb():
     return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🔙 Отмена / В меню", callback_data="cancel_action")]])
 
+# Кнопки «Новее / Старее» со ссылкой на соседнюю страницу: ev_page_<список>_<n|o>_<id>
+def page_nav_row(page, mode):
+    row = []
+    if page.newer is not None:
+        row.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=f"ev_page_{mode}_n_{page.newer}"))
+    if page.older is not None:
+        row.append(InlineKeyboardButton(text="Старее ➡️", callback_data=f"ev_page_{mode}_o_{page.older}"))
+    return row
+
 # --- ВСПОМОГАТЕЛЬНАЯ ФУНКЦИЯ ДЛЯ ФОТО ---
-def get_random_main_photo():
+# Возвращает путь к файлу; отправка идёт через media (по file_id, если файл уже загружали)
+def get_random_main_photo(branch):
     photos = ["img/main.jpg", "img/main2.jpg"]
-    selected = random.choice(photos)
-    return FSInputFile(selected)
+    return branch.path(random.choice(photos))
 
 # --- ХЕНДЛЕРЫ ---
 
 @dp.message(Command("start"))
-async def cmd_start(message: types.Message, pool):
-    await add_user(pool, message.from_user.id, message.from_user.username)
-    try:
-        photo = get_random_main_photo()
-    except:
-        photo = FSInputFile("img/main.jpg")
+async def cmd_start(message: types.Message, pool, branch):
+    branch.users.register(message.from_user.id, message.from_user.username)
+    photo = get_random_main_photo(branch)
 
-    caption = (
-        "👋 <b>Привет!</b>\n"
-        "Я — цифровой навигатор первичного отделения <b>МБОУ СОШ №9 г. Брянска</b>.\n\n"
-        "Я здесь, чтобы помочь тебе сориентироваться в событиях и проектах Движения Первых.\n"
-        "Подскажу, где найти информацию, напомню о дедлайнах и просто поболтаю!\n\n"
-        "👨‍💻 <i>Разработал:</i> общественный организатор Артём Карпов @temhdg\n"
-        "Поехали? 👇"
-    )
-    await message.answer_photo(photo=photo, caption=caption, parse_mode="HTML", reply_markup=main_menu_kb())
+    caption = branch.texts["start"]
+    await branch.media.send(pool, message.answer_photo, photo, caption=caption, parse_mode="HTML", reply_markup=main_menu_kb())
 
 # --- НАВИГАЦИЯ ---
 
 @dp.callback_query(F.data == "main_menu")
-async def nav_main_menu(callback: types.CallbackQuery):
-    await callback.message.delete()
-    try:
-        photo = get_random_main_photo()
-    except:
-        photo = FSInputFile("img/main.jpg")
-    caption = "Главное меню. Выбери раздел: 👇"
-    await callback.message.answer_photo(photo=photo, caption=caption, reply_markup=main_menu_kb())
+async def nav_main_menu(callback: types.CallbackQuery, pool, branch):
+    photo = get_random_main_photo(branch)
+    caption = branch.texts["main_menu"]
+    await branch.screens.show(callback, pool, caption, photo=photo, reply_markup=main_menu_kb())
 
 @dp.callback_query(F.data == "cancel_action")
-async def cancel_handler(callback: types.CallbackQuery, state: FSMContext):
+async def cancel_handler(callback: types.CallbackQuery, state: FSMContext, pool, branch):
     await state.clear()
-    await nav_main_menu(callback)
+    await nav_main_menu(callback, pool, branch)
 
 @dp.callback_query(F.data == "menu_sections")
-async def nav_sections(callback: types.CallbackQuery):
-    await callback.message.delete()
-    caption = "📂 <b>Меню разделов:</b>\nВыбери, что тебя интересует:"
-    await callback.message.answer(caption, parse_mode="HTML", reply_markup=sections_kb())
+async def nav_sections(callback: types.CallbackQuery, pool, branch):
+    caption = branch.texts["sections"]
+    await branch.screens.show(callback, pool, caption, reply_markup=sections_kb())
 
 # --- РАЗДЕЛЫ ---
 
 @dp.callback_query(F.data == "sec_about_movement")
-async def section_about(callback: types.CallbackQuery):
-    text = (
-        "🚀 <b>Что такое Движение Первых?</b>\n\n"
-        "Движение Первых – единственная общественная организация в стране, где дети и взрослые остаются равноправными участниками. "
-        "Это особое пространство для диалога детей, родителей, педагогов и наставников.\n\n"
-        "📌 <b>Миссия Движения:</b>\n"
-        "✅ Быть с Россией\n✅ Быть человеком\n✅ Быть вместе\n✅ Быть в движении\n✅ Быть Первыми\n\n"
-        "❤️ <b>Ценности:</b> Жизнь, Патриотизм, Дружба, Добро, Мечта, Труд.\n\n"
-        "<a href='https://будьвдвижении.рф/mission-values/'>🔗 Подробнее на сайте</a>"
-    )
-    await callback.message.delete()
-    await callback.message.answer(text, parse_mode="HTML", reply_markup=back_kb("menu_sections"), disable_web_page_preview=True)
+async def section_about(callback: types.CallbackQuery, pool, branch):
+    text = branch.texts["sec_about_movement"]
+    await branch.screens.show(callback, pool, text, reply_markup=back_kb("menu_sections"), disable_web_page_preview=True)
 
 @dp.callback_query(F.data == "sec_how_to_join")
-async def section_join_info(callback: types.CallbackQuery):
-    text = (
-        "📝 <b>Как вступить в Движение Первых?</b>\n\n"
-        "1️⃣ Зайди на сайт <a href='https://id.pervye.ru/ref/department/19889'>id.pervye.ru</a>\n"
-        "2️⃣ Нажми кнопку <b>Зарегистрироваться</b>.\n"
-        "3️⃣ <b>Важно!</b> Правильно введи личные данные: ФИО, возраст, место проживания, город, школу, почту.\n"
-        "4️⃣ <b>Прикрепись к первичке:</b> Нажми кнопку «Мое первичное отделение», в списке выбери <b>МБОУ СОШ №9 г. Брянск</b> и нажми «Сохранить».\n\n"
-        "Готово! Ты в команде! 🎉"
-    )
-    await callback.message.delete()
-    await callback.message.answer(text, parse_mode="HTML", reply_markup=back_kb("menu_sections"), disable_web_page_preview=True)
+async def section_join_info(callback: types.CallbackQuery, pool, branch):
+    text = branch.texts["sec_how_to_join"]
+    await branch.screens.show(callback, pool, text, reply_markup=back_kb("menu_sections"), disable_web_page_preview=True)
 
 @dp.callback_query(F.data == "sec_projects")
-async def section_projects(callback: types.CallbackQuery):
-    text = (
-        "💡 <b>Проекты Движения</b>\n\n"
-        "Со всеми проектами можно ознакомиться на официальном сайте: <a href='https://projects.pervye.ru'>projects.pervye.ru</a>\n\n"
-        "Там ты найдешь конкурсы, гранты и активности!"
-    )
-    await callback.message.delete()
-    try:
-        photo = FSInputFile("img/projects.jpg")
-        await callback.message.answer_photo(photo, caption=text, parse_mode="HTML", reply_markup=back_kb("menu_sections"))
-    except:
-        await callback.message.answer(text, parse_mode="HTML", reply_markup=back_kb("menu_sections"))
+async def section_projects(callback: types.CallbackQuery, pool, branch):
+    text = branch.texts["sec_projects"]
+    await branch.screens.show(callback, pool, text, photo=branch.path("img/projects.jpg"), reply_markup=back_kb("menu_sections"))
 
 @dp.callback_query(F.data == "get_calendar")
-async def get_calendar_file(callback: types.CallbackQuery):
+async def get_calendar_file(callback: types.CallbackQuery, pool, branch):
     try:
-        doc = FSInputFile("docs/calendar.pdf")
-        await callback.message.answer_document(document=doc, caption="📅 <b>Календарь событий</b>\nСкачивай и планируй!", parse_mode="HTML")
+        await branch.media.send(pool, callback.message.answer_document, branch.path("docs/calendar.pdf"), caption="📅 <b>Календарь событий</b>\nСкачивай и планируй!", parse_mode="HTML")
+        await callback.answer()
     except:
         await callback.answer("⚠️ Файл календаря загружается.", show_alert=True)
 
 @dp.callback_query(F.data == "sec_our_branch")
-async def section_branch(callback: types.CallbackQuery):
-    text = (
-        "🏫 <b>Наше Первичное отделение</b>\n\n"
-        "Всем привет! Мы первичное отделение <b>МБОУ СОШ №9 г. Брянска</b>.\n"
-        "Мы утверждаем: неуспешных детей нет. Успеха может добиться каждый!\n\n"
-        "<b>Наша команда:</b>\n"
-        "👤 <b>Куратор:</b> Седакова Елена Геннадьевна\n"
-        "👤 <b>Председатель Совета:</b> Алексеенкова Дарья\n"
-        "👤 <b>Наставник:</b> Межуева Алина Олеговна\n\n"
-        "Добивайся успеха вместе с нами!"
-    )
-    await callback.message.delete()
-    try:
-        photo = FSInputFile("img/team.jpg")
-        await callback.message.answer_photo(photo, caption=text, parse_mode="HTML", reply_markup=back_kb("menu_sections"))
-    except:
-        await callback.message.answer(text, parse_mode="HTML", reply_markup=back_kb("menu_sections"))
+async def section_branch(callback: types.CallbackQuery, pool, branch):
+    text = branch.texts["sec_our_branch"]
+    await branch.screens.show(callback, pool, text, photo=branch.path("img/team.jpg"), reply_markup=back_kb("menu_sections"))
 
 @dp.callback_query(F.data == "sec_activities")
-async def section_activities(callback: types.CallbackQuery):
-    text = (
-        "📢 <b>Деятельность первичного отделения</b>\n\n"
-        "<b>Наши основные направления:</b>\n"
-        "🇷🇺 <b>Патриотизм:</b> Акция «Окна Победы», квесты.\n"
-        "❤️ <b>Волонтерство:</b> Социальные акции, помощь нуждающимся.\n"
-        "⚽ <b>Спорт и ЗОЖ:</b> Спортивные мероприятия.\n"
-        "🧠 <b>Образование:</b> Квизы, мастер-классы, встречи с профи.\n"
-        "🎤 <b>Культура и медиа:</b> Творческие проекты, школьное радио «Девяточка»."
-    )
-    await callback.message.delete()
-    try:
-        photo = FSInputFile("img/activities.jpg")
-        await callback.message.answer_photo(photo, caption=text, parse_mode="HTML", reply_markup=back_kb("menu_sections"))
-    except:
-        await callback.message.answer(text, parse_mode="HTML", reply_markup=back_kb("menu_sections"))
+async def section_activities(callback: types.CallbackQuery, pool, branch):
+    text = branch.texts["sec_activities"]
+    await branch.screens.show(callback, pool, text, photo=branch.path("img/activities.jpg"), reply_markup=back_kb("menu_sections"))
 
 @dp.callback_query(F.data == "sec_contacts")
-async def section_contacts(callback: types.CallbackQuery):
-    text = (
-        "📞 <b>Наши контакты</b>\n\n"
-        "📲 <b>Группа Первички:</b> <a href='https://vk.ru/pervyedevyatochki'>vk.ru/pervyedevyatochki</a>\n"
-        "🏫 <b>Школьная группа:</b> <a href='https://vk.ru/sch9bryansk'>vk.ru/sch9bryansk</a>\n\n"
-        "👤 <b>Седакова Елена Геннадьевна:</b> @ElenaSedakovaSCH9\n"
-        "👤 <b>Межуева Алина Олеговна:</b> @a_kzlva\n\n"
-        "🔗 <b>Канал MAX:</b> <a href='https://max.ru/id3234036720_gos'>Перейти</a>"
-    )
-    await callback.message.delete()
-    try:
-        photo = FSInputFile("img/contacts.jpg")
-        await callback.message.answer_photo(photo, caption=text, parse_mode="HTML", reply_markup=back_kb("menu_sections"), disable_web_page_preview=True)
-    except:
-        await callback.message.answer(text, parse_mode="HTML", reply_markup=back_kb("menu_sections"), disable_web_page_preview=True)
+async def section_contacts(callback: types.CallbackQuery, pool, branch):
+    text = branch.texts["sec_contacts"]
+    await branch.screens.show(callback, pool, text, photo=branch.path("img/contacts.jpg"), reply_markup=back_kb("menu_sections"), disable_web_page_preview=True)
 
 # --- АНКЕТЫ ---
 
 @dp.callback_query(F.data == "join_movement")
-async def start_join_form(callback: types.CallbackQuery, state: FSMContext):
-    await callback.message.delete()
-    await callback.message.answer("📝 <b>Анкета вступления</b>\nВведите ваши ФИО:", parse_mode="HTML", reply_markup=cancel_kb())
+async def start_join_form(callback: types.CallbackQuery, state: FSMContext, pool, branch):
+    await branch.screens.show(callback, pool, "📝 <b>Анкета вступления</b>\nВведите ваши ФИО:", reply_markup=cancel_kb())
     await state.set_state(JoinState.waiting_for_fio)
 
 @dp.message(JoinState.waiting_for_fio)
@@ -324,84 +598,161 @@ async def join_direction(message: types.Message, state: FSMContext):
     await message.answer("Расскажите немного о себе:", reply_markup=cancel_kb())
     await state.set_state(JoinState.waiting_for_bio)
 
+# Ответы учеников идут в HTML-сообщение админам: экранируем и обрезаем, чтобы сводка влезла в лимит Telegram
+def user_text(text, limit=1000):
+    return html.escape((text or "")[:limit])
+
 @dp.message(JoinState.waiting_for_bio)
-async def join_finish(message: types.Message, state: FSMContext, bot: Bot):
+async def join_finish(message: types.Message, state: FSMContext, pool, branch):
     data = await state.get_data()
     admin_text = (
         f"✅ <b>Новая заявка на вступление!</b>\n"
         f"👤 От: @{message.from_user.username}\n"
-        f"📝 ФИО: {data['fio']}\n"
-        f"🎂 Возраст: {data['age']}\n"
-        f"🏫 Класс: {data['grade']}\n"
-        f"🎯 Направление: {data['direction']}\n"
-        f"💬 О себе: {message.text}"
+        f"📝 ФИО: {user_text(data['fio'], 200)}\n"
+        f"🎂 Возраст: {user_text(data['age'], 50)}\n"
+        f"🏫 Класс: {user_text(data['grade'], 50)}\n"
+        f"🎯 Направление: {user_text(data['direction'], 200)}\n"
+        f"💬 О себе: {user_text(message.text, 3000)}"
     )
-    await bot.send_message(ADMIN_GROUP_ID, admin_text, parse_mode="HTML")
+    await admin_outbox.put(pool, branch.id, branch.admin_chat_id, "join", admin_text)
     await message.answer("✅ Спасибо! Заявка отправлена.", reply_markup=back_kb("main_menu", "🏠 В главное меню"))
     await state.clear()
 
 @dp.callback_query(F.data == "send_idea")
-async def start_idea(callback: types.CallbackQuery, state: FSMContext):
-    await callback.message.delete()
-    await callback.message.answer("💡 <b>Есть идея?</b>\nОпиши её одним сообщением:", parse_mode="HTML", reply_markup=cancel_kb())
+async def start_idea(callback: types.CallbackQuery, state: FSMContext, pool, branch):
+    await branch.screens.show(callback, pool, "💡 <b>Есть идея?</b>\nОпиши её одним сообщением:", reply_markup=cancel_kb())
     await state.set_state(IdeaState.waiting_for_text)
 
 @dp.message(IdeaState.waiting_for_text)
-async def process_idea(message: types.Message, state: FSMContext, bot: Bot):
+async def process_idea(message: types.Message, state: FSMContext, pool, branch):
     admin_text = (
         f"💡 <b>Новая ИДЕЯ!</b>\n"
         f"👤 От: @{message.from_user.username}\n"
-        f"💬 Суть: {message.text}"
+        f"💬 Суть: {user_text(message.text, 3500)}"
     )
-    await bot.send_message(ADMIN_GROUP_ID, admin_text, parse_mode="HTML")
+    await admin_outbox.put(pool, branch.id, branch.admin_chat_id, "idea", admin_text)
     await message.answer("✅ Идея отправлена!", reply_markup=back_kb("main_menu", "🏠 В главное меню"))
     await state.clear()
 
 # --- АДМИНКА ---
 
 @dp.message(Command("panel"))
-async def admin_panel(message: types.Message):
-    if message.chat.id != ADMIN_GROUP_ID:
+async def admin_panel(message: types.Message, branch):
+    if message.chat.id != branch.admin_chat_id:
         return
     kb = [
         [InlineKeyboardButton(text="➕ Добавить мероприятие", callback_data="add_event")],
         [InlineKeyboardButton(text="📢 Рассылка (сообщение всем)", callback_data="broadcast_msg")],
         [InlineKeyboardButton(text="👀 Просмотреть мероприятия", callback_data="list_events")],
+        [InlineKeyboardButton(text="🗄 Отправить в архив", callback_data="arch_event_menu")],
         [InlineKeyboardButton(text="❌ Удалить мероприятие", callback_data="del_event_menu")]
     ]
     await message.answer("🛠 <b>Панель администратора:</b>", parse_mode="HTML", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
 
-@dp.callback_query(F.data == "list_events")
-async def list_events_handler(callback: types.CallbackQuery, pool):
-    events = await get_events_db(pool)
-    if not events:
-        await callback.answer("Мероприятий пока нет.", show_alert=True)
+@dp.message(Command("stats"))
+async def admin_stats(message: types.Message, branch):
+    if message.chat.id != branch.admin_chat_id:
         return
-    
-    response = "🗓 <b>АКТУАЛЬНЫЕ МЕРОПРИЯТИЯ:</b>\n\n"
+    ev = branch.events.stats()
+    ans = branch.answers.stats()
+    text = (
+        "📊 <b>Статистика кэшей</b>\n"
+        f"🗓 Мероприятия: попаданий {ev['hits']}, промахов {ev['misses']}\n"
+        f"🤖 Ответы ИИ: попаданий {ans['hits']}, промахов {ans['misses']} "
+        f"({ans['hit_rate']:.0%}), в кэше {ans['size']}\n"
+        f"💬 Диалогов в памяти: {len(dialogs)}, сжато сводками: {dialogs.summaries}\n"
+        f"📝 Анкеты (FSM): попаданий {storage.hits}, промахов {storage.misses}\n"
+        f"📭 Недоступны для рассылок (заблокировали бота или удалили аккаунт): {branch.users.inactive}\n"
+        f"🚦 Отклонено лимитом: {throttling.rejected}, вопросов заменено новыми: {throttling.superseded}\n"
+        f"📬 Уведомления админам: доставлено {admin_outbox.sent} ({admin_outbox.messages} сообщ.), "
+        f"отброшено {admin_outbox.failed}\n"
+        f"♻️ После перезапуска: разобрано {backlog.total} апдейтов из очереди за {backlog.seconds:.1f} сек., "
+        f"устаревших нажатий {backlog.stale_callbacks}\n"
+        f"🏫 Филиалов в процессе: {len(branches)}"
+    )
+    await message.answer(text, parse_mode="HTML")
+
+@dp.message(Command("metrics"))
+async def admin_metrics(message: types.Message, branch):
+    if message.chat.id != branch.admin_chat_id:
+        return
+    await message.answer(metrics.summary(), parse_mode="HTML")
+    dump = metrics.REGISTRY.render().encode()
+    await message.answer_document(BufferedInputFile(dump, filename="metrics.txt"))
+
+async def show_events_list(callback, pool, branch, archived=False, before=None, after=None):
+    page = await get_events_page(branch, pool, archived, before, after)
+    if not page.items:
+        await callback.answer("В архиве пока пусто." if archived else "Мероприятий пока нет.", show_alert=True)
+        return
+
+    response = "🗄 <b>ПРОШЕДШИЕ МЕРОПРИЯТИЯ:</b>\n\n" if archived else "🗓 <b>АКТУАЛЬНЫЕ МЕРОПРИЯТИЯ:</b>\n\n"
     kb_list = []
-    for idx, event in enumerate(events, 1):
+    for idx, event in enumerate(page.items, 1):
         emojis = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
         icon = emojis[idx-1] if idx <= 10 else f"{idx}."
-        response += f"{icon} <b>{event['short_text']}</b>\n➖➖➖➖➖➖\n"
+        response += f"{icon} <b>{event['short_text'][:200]}</b>\n➖➖➖➖➖➖\n"
         kb_list.append([InlineKeyboardButton(text=f"{icon} Подробнее", callback_data=f"view_event_{event['id']}")])
-    
+
+    nav = page_nav_row(page, "r" if archived else "a")
+    if nav:
+        kb_list.append(nav)
+    if archived:
+        kb_list.append([InlineKeyboardButton(text="🔥 Актуальные", callback_data="list_events")])
+    else:
+        kb_list.append([InlineKeyboardButton(text="🗄 Прошедшие", callback_data="events_archive")])
     kb_list.append([InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu")])
-    await callback.message.delete()
-    await callback.message.answer(response, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb_list))
+    await branch.screens.show(callback, pool, response, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb_list))
+
+# Кнопки мероприятий для админки: «d» — удалить актуальное, «D» — удалить из архива, «x» — в архив
+async def admin_events_kb(branch, pool, mode, before=None, after=None):
+    page = await get_events_page(branch, pool, archived=mode == "D", before=before, after=after)
+    if not page.items:
+        return None
+    icon, action = ("🗄", "arch_conf") if mode == "x" else ("❌", "del_conf")
+    kb_list = [[InlineKeyboardButton(text=f"{icon} {e['short_text'][:15]}...", callback_data=f"{action}_{e['id']}")] for e in page.items]
+    nav = page_nav_row(page, mode)
+    if nav:
+        kb_list.append(nav)
+    # Старые мероприятия уходят в архив сами (EVENTS_ACTIVE_LIMIT), но удалить их тоже должно быть можно
+    if mode == "d":
+        kb_list.append([InlineKeyboardButton(text="🗄 Удалить из прошедших", callback_data="del_list_D")])
+    elif mode == "D":
+        kb_list.append([InlineKeyboardButton(text="🔥 Удалить из актуальных", callback_data="del_list_d")])
+    kb_list.append([InlineKeyboardButton(text="🔙 Отмена", callback_data="main_menu")])
+    return InlineKeyboardMarkup(inline_keyboard=kb_list)
+
+@dp.callback_query(F.data == "list_events")
+async def list_events_handler(callback: types.CallbackQuery, pool, branch):
+    await show_events_list(callback, pool, branch)
+
+@dp.callback_query(F.data == "events_archive")
+async def archive_list_handler(callback: types.CallbackQuery, pool, branch):
+    await show_events_list(callback, pool, branch, archived=True)
+
+@dp.callback_query(F.data.startswith("ev_page_"))
+async def events_page_handler(callback: types.CallbackQuery, pool, branch):
+    _, _, mode, direction, cursor = callback.data.split("_")
+    before, after = (int(cursor), None) if direction == "o" else (None, int(cursor))
+    if mode in ("a", "r"):
+        await show_events_list(callback, pool, branch, archived=mode == "r", before=before, after=after)
+        return
+    kb = await admin_events_kb(branch, pool, mode, before, after)
+    await callback.answer()
+    if kb:
+        await callback.message.edit_reply_markup(reply_markup=kb)
 
 @dp.callback_query(F.data.startswith("view_event_"))
-async def view_event_detail(callback: types.CallbackQuery, pool):
+async def view_event_detail(callback: types.CallbackQuery, pool, branch):
     event_id = int(callback.data.split("_")[2])
-    event = await get_event_by_id(pool, event_id)
+    event = await get_event_by_id(branch, pool, event_id)
     if event:
         text = f"📢 <b>ПОДРОБНОСТИ:</b>\n\n{event['long_text']}"
-        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🔙 К списку", callback_data="list_events")]])
-        await callback.message.delete()
-        if event['photo_id']:
-            await callback.message.answer_photo(event['photo_id'], caption=text, reply_markup=kb, parse_mode="HTML")
-        else:
-            await callback.message.answer(text, reply_markup=kb, parse_mode="HTML")
+        # Мероприятие из архива — назад к прошедшим
+        active = any(e['id'] == event_id for e in await get_events_db(branch, pool))
+        back = "list_events" if active else "events_archive"
+        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🔙 К списку", callback_data=back)]])
+        await branch.screens.show(callback, pool, text, photo_id=event['photo_id'], reply_markup=kb)
     else:
         await callback.answer("Мероприятие удалено.", show_alert=True)
 
@@ -424,34 +775,58 @@ async def process_long(message: types.Message, state: FSMContext):
     await state.set_state(AdminEvent.waiting_for_photo)
 
 @dp.message(AdminEvent.waiting_for_photo)
-async def process_photo(message: types.Message, state: FSMContext, pool):
+async def process_photo(message: types.Message, state: FSMContext, pool, branch):
     data = await state.get_data()
     photo_id = message.photo[-1].file_id if message.photo else None
-    await add_event_db(pool, data['short_text'], data['long_text'], photo_id)
+    await add_event_db(branch, pool, data['short_text'], data['long_text'], photo_id)
     await message.answer("✅ Мероприятие добавлено!")
     await state.clear()
-    users = await get_all_users(pool)
-    for uid in users:
-        try:
-            msg = f"⚡ <b>НОВОЕ МЕРОПРИЯТИЕ!</b>\n\n{data['short_text']}\n\n👉 <i>Жми кнопку 'Актуальные мероприятия' в меню!</i>"
-            await bot.send_message(uid, msg, parse_mode="HTML")
-        except: pass
-    await message.answer("Рассылка завершена.")
+    users, total = await get_recipients(branch)
+    msg = f"⚡ <b>НОВОЕ МЕРОПРИЯТИЕ!</b>\n\n{data['short_text']}\n\n👉 <i>Жми кнопку 'Актуальные мероприятия' в меню!</i>"
+
+    async def send(uid):
+        await branch.bot.send_message(uid, msg, parse_mode="HTML")
+
+    branch.broadcaster.start(users, send, report_chat_id=message.chat.id, title="Новое мероприятие", total=total)
 
 @dp.callback_query(F.data == "del_event_menu")
-async def del_menu(callback: types.CallbackQuery, pool):
-    events = await get_events_db(pool)
-    if not events:
+async def del_menu(callback: types.CallbackQuery, pool, branch):
+    kb = await admin_events_kb(branch, pool, "d") or await admin_events_kb(branch, pool, "D")
+    if not kb:
         await callback.answer("Нечего удалять.", show_alert=True)
         return
-    kb_list = [[InlineKeyboardButton(text=f"❌ {e['short_text'][:15]}...", callback_data=f"del_conf_{e['id']}")] for e in events]
-    kb_list.append([InlineKeyboardButton(text="🔙 Отмена", callback_data="main_menu")])
-    await callback.message.answer("Выберите, что удалить:", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb_list))
+    await callback.message.answer("Выберите, что удалить:", reply_markup=kb)
+    await callback.answer()
+
+@dp.callback_query(F.data.in_({"del_list_d", "del_list_D"}))
+async def del_menu_switch(callback: types.CallbackQuery, pool, branch):
+    kb = await admin_events_kb(branch, pool, callback.data[-1])
+    if not kb:
+        await callback.answer("Здесь удалять нечего.", show_alert=True)
+        return
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=kb)
+
+@dp.callback_query(F.data == "arch_event_menu")
+async def arch_menu(callback: types.CallbackQuery, pool, branch):
+    kb = await admin_events_kb(branch, pool, "x")
+    if not kb:
+        await callback.answer("Актуальных мероприятий нет.", show_alert=True)
+        return
+    await callback.message.answer("Что отправить в архив?", reply_markup=kb)
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("arch_conf_"))
+async def arch_confirm(callback: types.CallbackQuery, pool, branch):
+    eid = int(callback.data.split("_")[2])
+    await archive_event_db(branch, pool, eid)
+    await callback.answer("Перенесено в архив!")
+    await callback.message.delete()
 
 @dp.callback_query(F.data.startswith("del_conf_"))
-async def del_confirm(callback: types.CallbackQuery, pool):
+async def del_confirm(callback: types.CallbackQuery, pool, branch):
     eid = int(callback.data.split("_")[2])
-    await delete_event_db(pool, eid)
+    await delete_event_db(branch, pool, eid)
     await callback.answer("Удалено!")
     await callback.message.delete()
 
@@ -468,64 +843,214 @@ async def broadcast_text(message: types.Message, state: FSMContext):
     await state.set_state(BroadcastState.waiting_for_photo)
 
 @dp.message(BroadcastState.waiting_for_photo)
-async def broadcast_finish(message: types.Message, state: FSMContext, pool):
+async def broadcast_finish(message: types.Message, state: FSMContext, branch):
     data = await state.get_data()
     photo_id = message.photo[-1].file_id if message.photo else None
-    users = await get_all_users(pool)
-    count = 0
-    await message.answer("🚀 Начинаю рассылку...")
-    for uid in users:
-        try:
-            if photo_id:
-                await bot.send_photo(uid, photo_id, caption=data['text'], parse_mode="HTML")
-            else:
-                await bot.send_message(uid, data['text'], parse_mode="HTML")
-            count += 1
-        except: pass
-    await message.answer(f"✅ Рассылка завершена. Получили: {count} чел.")
+    users, total = await get_recipients(branch)
     await state.clear()
 
+    async def send(uid):
+        if photo_id:
+            await branch.bot.send_photo(uid, photo_id, caption=data['text'], parse_mode="HTML")
+        else:
+            await branch.bot.send_message(uid, data['text'], parse_mode="HTML")
+
+    branch.broadcaster.start(users, send, report_chat_id=message.chat.id, title="Рассылка", total=total)
+    await message.answer("🚀 Рассылка запущена в фоне, прогресс будет ниже.")
+
 # --- НЕЙРОСЕТЬ (УМНАЯ) ---
 
 @dp.callback_query(F.data == "ask_ai")
-async def ask_ai_mode(callback: types.CallbackQuery):
-    await callback.message.delete()
-    await callback.message.answer("🤖 <b>Я на связи!</b>\nНапиши мне любой вопрос про школу, Движение или наши мероприятия.", parse_mode="HTML", reply_markup=back_kb())
+async def ask_ai_mode(callback: types.CallbackQuery, pool, branch):
+    await branch.screens.show(callback, pool, branch.texts["ask_ai"], reply_markup=ask_ai_kb())
+
+@dp.callback_query(F.data == "ai_reset")
+async def ai_reset(callback: types.CallbackQuery, pool, branch):
+    dialogs.reset((branch.id, callback.from_user.id))
+    await callback.answer("🧹 Забыл наш разговор, спрашивай заново!")
+    await branch.screens.show(callback, pool, branch.texts["ask_ai"], reply_markup=ask_ai_kb())
 
-@dp.message()
-async def chat_with_ai(message: types.Message, pool):
+@dp.message(F.chat.type == "private", flags={"rate": "ai"})
+async def chat_with_ai(message: types.Message, pool, branch):
     if message.chat.type != 'private': return
+    question = message.text or ""
+    dialog_key = (branch.id, message.from_user.id)
+    summary, history = dialogs.history(dialog_key)
+    first_question = not (summary or history)
+
+    # 0. Частые вопросы отвечаем из кэша, не дёргая нейросеть. Посреди разговора ответ
+    # зависит от прошлых реплик («а когда это?»), поэтому кэш только для первого вопроса
+    branch.answers.check_version(branch.events.version)
+    cached = branch.answers.get(question) if first_question else None
+    if cached:
+        await send_long(message, cached)
+        dialogs.add(dialog_key, question, cached)
+        return
+
     waiting_msg = await message.answer("🤖 <i>Думаю...</i>", parse_mode="HTML")
     
     try:
-        # 1. Получаем актуальные школьные мероприятия из БД
-        events = await get_events_db(pool)
-        events_str = "\n".join([f"- {e['short_text']}: {e['long_text']}" for e in events]) if events else "В списке актуальных мероприятий школы сейчас пусто."
-
-        # 2. Формируем полный промпт (Сначала База, потом Текущее из БД)
-        FULL_PROMPT = BASE_SYSTEM_PROMPT + f"\n\nВАЖНО: НИЖЕ СПИСОК МЕРОПРИЯТИЙ, КОТОРЫЕ ИДУТ В ШКОЛЕ ПРЯМО СЕЙЧАС (ИЗ БАЗЫ ДАННЫХ):\n{events_str}\n\nЕсли ученик спрашивает 'что у нас будет', смотри в этот список. Если там нет — отвечай, что пока мероприятий не запланировано."
-
-        # 3. Отправляем в GigaChat
-        with GigaChat(credentials=GIGACHAT_KEY, verify_ssl_certs=False) as giga:
-            payload = {
-                "messages": [
-                    {"role": "system", "content": FULL_PROMPT},
-                    {"role": "user", "content": message.text}
-                ]
-            }
-            response = giga.chat(payload)
-            await waiting_msg.edit_text(response.choices[0].message.content)
-            
+        # 1. Получаем актуальные школьные мероприятия (из кэша)
+        events = await get_events_db(branch, pool)
+
+        # 2. Формируем промпт: постоянная часть базы + релевантные вопросу пункты и мероприятия.
+        # Для уточняющего вопроса ищем и по предыдущему: в «а когда это?» искать нечего
+        if AI_RETRIEVAL:
+            query = " ".join([m["content"] for m in history if m["role"] == "user"][-1:] + [question])
+            FULL_PROMPT = branch.knowledge.build_prompt(query, events, version=branch.events.version)
+        else:
+            FULL_PROMPT = stuff_prompt(branch.prompt or BASE_SYSTEM_PROMPT, events)
+        if summary:
+            FULL_PROMPT += f"\n\nРАНЕЕ В ЭТОМ РАЗГОВОРЕ: {summary}"
+
+        # 3. Отправляем в GigaChat вместе с недавней перепиской (общий клиент, не блокирует остальные апдейты)
+        messages = [
+            {"role": "system", "content": FULL_PROMPT},
+            *history,
+            {"role": "user", "content": message.text}
+        ]
+        if AI_STREAMING:
+            reply = ProgressiveReply(waiting_msg, interval=AI_EDIT_INTERVAL, min_chars=AI_EDIT_MIN_CHARS)
+            parts = []
+            async for chunk in ai_client.stream(messages):
+                parts.append(chunk)
+                await reply.feed(chunk)
+            await reply.finish()
+            answer = "".join(parts)
+        else:
+            answer = await ai_client.chat(messages)
+            await waiting_msg.edit_text(answer)
+        if first_question:
+            branch.answers.put(question, answer)
+        dialogs.add(dialog_key, question, answer)
+
+    except asyncio.CancelledError:
+        # Пользователь задал новый вопрос, этот отменён в ThrottlingMiddleware
+        try:
+            await waiting_msg.edit_text("⏹ Отвечаю на твой новый вопрос.")
+        except Exception:
+            pass
+        raise
     except Exception as e:
         await waiting_msg.edit_text(f"Ошибка: {e}")
 
+    # Ответ уже у пользователя; если он спросит снова, сжатие просто отменится и повторится позже
+    await dialogs.compact(dialog_key)
+
 # --- ЗАПУСК ---
+async def create_pool():
+    pool = await asyncpg.create_pool(dsn=DATABASE_URL, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX)
+    metrics.watch_pool(pool)
+    return metrics.InstrumentedPool(pool)
+
+async def start_metrics(worker):
+    if METRICS_PORT:
+        app = lifecycle.add_routes(metrics.build_app())
+        dp["metrics_runner"] = await metrics.start_server(METRICS_HOST, METRICS_PORT + worker, app)
+
+async def warm_media(branch, pool):
+    await branch.media.load(pool)
+    paths = [branch.path(p) for p in STATIC_MEDIA]
+    await branch.media.prepare(pool, paths, branch.bot, branch.media_upload_chat_id)
+
+# Всё, что читает из БД, стартует параллельно (по всем филиалам сразу)
+async def on_startup(pool):
+    await load_branches(pool)
+    await asyncio.gather(
+        events_listener.listen(pool),
+        storage.start(pool),
+        *(warm_media(branch, pool) for branch in branches),
+        *(branch.users.start(pool) for branch in branches),
+    )
+    # Заявки, накопленные, пока у филиала не было админского чата, уходят в появившийся чат
+    await asyncio.gather(*(admin_outbox.assign(pool, b.id, b.admin_chat_id) for b in branches if b.admin_chat_id))
+    admin_outbox.start(pool)
+    dp["pool"] = pool
+
+async def on_shutdown(pool):
+    # Сначала доделываем начатые апдейты, потом сбрасываем буферы и закрываем соединения
+    await lifecycle.drain(SHUTDOWN_TIMEOUT)
+    await asyncio.gather(*(branch.broadcaster.wait_all(SHUTDOWN_TIMEOUT) for branch in branches))
+    await admin_outbox.stop()
+    await asyncio.gather(*(branch.users.stop() for branch in branches))
+    await storage.close()
+    await ai_client.close()
+    await events_listener.close(pool)
+    await pool.close()
+    if api_session is not None:
+        await api_session.close()
+    if "metrics_runner" in dp.workflow_data:
+        await dp["metrics_runner"].cleanup()
+
+# Пул (asyncpg открывает DB_POOL_MIN соединений параллельно), /healthz и токен GigaChat
+# идут одновременно; затем миграции, филиалы и прогрев кэшей
+async def start(worker=0):
+    pool, *_ = await asyncio.gather(create_pool(), start_metrics(worker), ai_client.prefetch_token())
+    await create_tables(pool)
+    await on_startup(pool)
+    return pool
+
 async def main():
-    pool = await asyncpg.create_pool(dsn=DATABASE_URL)
+    pool = await start()
+    try:
+        drop = PENDING_UPDATES == "drop"
+        await asyncio.gather(*(branch.bot.delete_webhook(drop_pending_updates=drop) for branch in branches))
+        lifecycle.mark_ready()
+        if not drop:
+            # Накопившееся за перезапуск разбираем до polling, чтобы не нарушить порядок внутри чата
+            allowed = dp.resolve_used_update_types()
+            await asyncio.gather(*(backlog.drain(branch.bot, allowed) for branch in branches))
+        # Сессию ботов закрывает on_shutdown: она ещё нужна хендлерам, которые доделываются
+        await dp.start_polling(*(branch.bot for branch in branches), close_bot_session=False)
+    finally:
+        await on_shutdown(pool)
+
+# Один филиал — прежний адрес вебхука, несколько — у каждого бота свой: WEBHOOK_URL/<id бота>
+def webhook_url(bot):
+    return WEBHOOK_URL if len(branches) == 1 else f"{WEBHOOK_URL.rstrip('/')}/{bot.id}"
+
+# С PENDING_UPDATES=drain накопившееся Telegram сам дошлёт на вебхук, как только воркеры поднимутся
+async def set_webhook(bot):
+    if PENDING_UPDATES != "drop":
+        info = await bot.get_webhook_info()
+        logger.info("Бот %s: в очереди %s апдейтов, их доставит вебхук", bot.id, info.pending_update_count)
+    await bot.set_webhook(
+        webhook_url(bot),
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=PENDING_UPDATES == "drop",
+    )
+
+# Webhook: миграции и адреса вебхуков настраиваем один раз, до запуска воркеров
+async def prepare_webhook():
+    pool = await asyncpg.create_pool(dsn=DATABASE_URL, min_size=1, max_size=1)
     await create_tables(pool)
-    dp["pool"] = pool
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    await load_branches(pool)
+    await pool.close()
+    await asyncio.gather(*(set_webhook(branch.bot) for branch in branches))
+    await api_session.close()
+
+async def webhook_worker(worker):
+    pool = await start(worker)
+    lifecycle.mark_ready()
+    try:
+        bots = [branch.bot for branch in branches]
+        app = lifecycle.add_routes(build_app(dp, bots, WEBHOOK_PATH, WEBHOOK_SECRET))
+        await serve(app, WEBHOOK_HOST, WEBHOOK_PORT, reuse_port=WEBHOOK_WORKERS > 1)
+    finally:
+        await on_shutdown(pool)
+
+def run_webhook_worker(worker):
+    asyncio.run(webhook_worker(worker))
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_SECRET:
+            # Через окружение: воркер, запущенный через spawn/forkserver, заново импортирует модуль
+            # и прочитает тот же секрет, что уйдёт в set_webhook
+            WEBHOOK_SECRET = os.environ["WEBHOOK_SECRET"] = secrets.token_urlsafe(32)
+            logger.info("WEBHOOK_SECRET не задан, сгенерирован новый")
+        asyncio.run(prepare_webhook())
+        run_workers(run_webhook_worker, WEBHOOK_WORKERS)
+    else:
+        asyncio.run(main())
@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import logging
+import os
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+logger = logging.getLogger(__name__)
+
+
+def _file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _extract_file_id(message):
+    if message.photo:
+        return message.photo[-1].file_id
+    for attr in ("document", "video", "animation", "audio"):
+        media = getattr(message, attr, None)
+        if media:
+            return media.file_id
+    return None
+
+
+class MediaRegistry:
+    """Статические файлы (img/*.jpg, docs/calendar.pdf) загружаются в Telegram один раз.
+
+    Полученный file_id хранится в таблице media_files вместе с хэшем файла,
+    дальше отправляем по file_id. Если файл на диске изменился или Telegram
+    не принял старый file_id — загружаем заново. file_id действует только
+    для бота, который загрузил файл, поэтому реестр у каждого филиала свой,
+    а хэши файлов на диске общие.
+    """
+
+    _hashes = {}  # path -> (mtime, size, content_hash), общий для всех филиалов
+
+    def __init__(self, branch):
+        self.branch = branch
+        self._file_ids = {}  # path -> (content_hash, file_id)
+        self._locks = {}
+
+    async def load(self, pool):
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("SELECT path, content_hash, file_id FROM media_files WHERE branch_id = $1", self.branch)
+        self._file_ids = {r['path']: (r['content_hash'], r['file_id']) for r in rows}
+
+    async def content_hash(self, path):
+        st = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+            return cached[2]
+        digest = await asyncio.to_thread(_file_hash, path)
+        self._hashes[path] = (st.st_mtime, st.st_size, digest)
+        return digest
+
+    async def file_id(self, path):
+        """file_id для актуальной версии файла или None, если её ещё не загружали."""
+        digest = await self.content_hash(path)
+        cached = self._file_ids.get(path)
+        if cached and cached[0] == digest:
+            return cached[1]
+        return None
+
+    async def prepare(self, pool, paths, bot=None, chat_id=None):
+        """Заранее считает хэши файлов и загружает новые и изменённые в служебный чат chat_id.
+
+        Загруженное сообщение сразу удаляется, file_id остаётся. Без chat_id
+        только считаются хэши, а загрузка случится при первом показе.
+        """
+        paths = [p for p in paths if os.path.exists(p)]
+        file_ids = await asyncio.gather(*(self.file_id(p) for p in paths))
+        missing = [p for p, file_id in zip(paths, file_ids) if file_id is None]
+        if not missing or not bot or not chat_id:
+            return
+        # По одному: в группу Telegram пускает ~20 сообщений в минуту
+        loaded = 0
+        for path in missing:
+            photo = path.lower().endswith((".jpg", ".jpeg", ".png"))
+            send = bot.send_photo if photo else bot.send_document
+            try:
+                message = await send(chat_id, FSInputFile(path), disable_notification=True)
+                await self.remember(pool, path, message)
+                loaded += 1
+                await bot.delete_message(chat_id, message.message_id)
+            except Exception as e:
+                logger.warning("Не удалось заранее загрузить %s: %s", path, e)
+        logger.info("Заранее загружено файлов: %s из %s", loaded, len(missing))
+
+    async def send(self, pool, send_func, path, **kwargs):
+        """Отправляет файл через send_func(media, **kwargs), например message.answer_photo."""
+        file_id = await self.file_id(path)
+        if file_id:
+            try:
+                return await send_func(file_id, **kwargs)
+            except TelegramBadRequest as e:
+                if "file" not in str(e).lower():
+                    raise
+                logger.info("Telegram не принял file_id для %s, загружаю заново", path)
+                self._file_ids.pop(path, None)
+
+        lock = self._locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            # Пока ждали, файл мог загрузить соседний запрос
+            file_id = await self.file_id(path)
+            if file_id:
+                return await send_func(file_id, **kwargs)
+            message = await send_func(FSInputFile(path), **kwargs)
+            await self.remember(pool, path, message)
+            return message
+
+    async def remember(self, pool, path, message):
+        file_id = _extract_file_id(message)
+        if not file_id:
+            return
+        digest = await self.content_hash(path)
+        self._file_ids[path] = (digest, file_id)
+        async with pool.acquire() as conn:
+            await conn.execute(
+                "INSERT INTO media_files (branch_id, path, content_hash, file_id) VALUES ($1, $2, $3, $4) "
+                "ON CONFLICT (branch_id, path) DO UPDATE SET content_hash = EXCLUDED.content_hash, file_id = EXCLUDED.file_id",
+                self.branch, path, digest, file_id,
+            )
@@ -0,0 +1,333 @@
+import logging
+import re
+import time
+from bisect import bisect_left
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import CallbackQuery, Message
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+# --- ПРИМИТИВЫ (текстовый формат Prometheus без внешних зависимостей) ---
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labels)
+        self.values = {}
+        REGISTRY.register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name + "_total" + _labels(self.labelnames, key), value
+
+
+class Gauge:
+    """Значение считается в момент выгрузки: fn() -> {(label values...): value}."""
+
+    type = "gauge"
+
+    def __init__(self, name, doc, labels=(), fn=None):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labels)
+        self.fn = fn
+        REGISTRY.register(self)
+
+    def samples(self):
+        if self.fn is None:
+            return
+        try:
+            values = self.fn()
+        except Exception as e:
+            logger.debug("Метрика %s не посчиталась: %s", self.name, e)
+            return
+        for key, value in values.items():
+            yield self.name + _labels(self.labelnames, key), value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [counts по бакетам..., +Inf, sum]
+        REGISTRY.register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        row = self.values.get(key)
+        if row is None:
+            row = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def quantile(self, q, key):
+        """Грубая оценка квантиля по бакетам — для сводки в чат."""
+        row = self.values.get(key)
+        if not row:
+            return 0.0
+        count = sum(row[:-1])
+        target, seen = q * count, 0
+        for bound, n in zip(self.buckets + (float("inf"),), row[:-1]):
+            seen += n
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        for key, row in self.values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, row):
+                cumulative += n
+                yield self.name + "_bucket" + _labels(self.labelnames, key, ("le", repr(bound))), cumulative
+            cumulative += row[len(self.buckets)]
+            yield self.name + "_bucket" + _labels(self.labelnames, key, ("le", "+Inf")), cumulative
+            yield self.name + "_sum" + _labels(self.labelnames, key), row[-1]
+            yield self.name + "_count" + _labels(self.labelnames, key), cumulative
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram, self.labels = histogram, labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for m in self.metrics:
+            lines.append(f"# HELP {m.name} {m.doc}")
+            lines.append(f"# TYPE {m.name} {m.type}")
+            for name, value in m.samples():
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- МЕТРИКИ БОТА ---
+handler_seconds = Histogram("bot_handler_seconds", "Время работы хендлера", ("handler", "key"))
+handler_errors = Counter("bot_handler_errors", "Исключения в хендлерах", ("handler", "key"))
+db_query_seconds = Histogram("bot_db_query_seconds", "Время запроса к Postgres", ("query",))
+db_acquire_seconds = Histogram("bot_db_acquire_seconds", "Ожидание свободного соединения в пуле")
+ai_request_seconds = Histogram("bot_ai_request_seconds", "Время ответа GigaChat", ("mode",))
+ai_first_token_seconds = Histogram("bot_ai_first_token_seconds", "Время до первого куска потокового ответа")
+ai_tokens = Counter("bot_ai_tokens", "Токены GigaChat", ("kind",))
+ai_errors = Counter("bot_ai_errors", "Ошибки запросов к GigaChat")
+api_request_seconds = Histogram("bot_api_request_seconds", "Время вызова Bot API", ("method",))
+api_retry_after = Counter("bot_api_retry_after", "Ответы 429 Too Many Requests от Bot API", ("method",))
+api_errors = Counter("bot_api_errors", "Прочие ошибки Bot API", ("method",))
+
+
+# --- ХЕНДЛЕРЫ ---
+_DIGITS = re.compile(r"\d+")
+
+
+def handler_key(event, data):
+    """callback_data (числа заменены на #), состояние FSM, команда или тип сообщения.
+
+    Команда попадает в метку, только если её поймал фильтр Command (он кладёт
+    в data CommandObject): произвольный текст со слешем ушёл бы в метки как есть.
+    """
+    if isinstance(event, CallbackQuery):
+        return _DIGITS.sub("#", event.data or "")
+    state = data.get("raw_state")
+    if state:
+        return state
+    command = data.get("command")
+    if isinstance(event, Message) and command is not None:
+        return f"/{command.command}"
+    return "message"
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        key = handler_key(event, data)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(handler=name, key=key)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, handler=name, key=key)
+
+
+# --- BOT API ---
+class BotApiMetrics(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            api_retry_after.inc(method=name)
+            raise
+        except Exception:
+            api_errors.inc(method=name)
+            raise
+        finally:
+            api_request_seconds.observe(time.perf_counter() - started, method=name)
+
+
+# --- POSTGRES ---
+_SQL_NAME = re.compile(r"^\s*(\w+)(?:.*?\b(?:FROM|INTO|UPDATE|TABLE(?: IF NOT EXISTS)?)\s+(\w+))?", re.I | re.S)
+
+
+def query_name(sql):
+    m = _SQL_NAME.match(sql)
+    if not m:
+        return "other"
+    verb, table = m.group(1).upper(), m.group(2)
+    return f"{verb} {table}" if table else verb
+
+
+class _InstrumentedConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def _timed(self, method, sql, *args, **kwargs):
+        with db_query_seconds.time(query=query_name(sql)):
+            return await getattr(self._conn, method)(sql, *args, **kwargs)
+
+    async def execute(self, sql, *args, **kwargs):
+        return await self._timed("execute", sql, *args, **kwargs)
+
+    async def executemany(self, sql, *args, **kwargs):
+        return await self._timed("executemany", sql, *args, **kwargs)
+
+    async def fetch(self, sql, *args, **kwargs):
+        return await self._timed("fetch", sql, *args, **kwargs)
+
+    async def fetchrow(self, sql, *args, **kwargs):
+        return await self._timed("fetchrow", sql, *args, **kwargs)
+
+    async def fetchval(self, sql, *args, **kwargs):
+        return await self._timed("fetchval", sql, *args, **kwargs)
+
+
+class _AcquireContext:
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+
+    async def _acquire(self):
+        with db_acquire_seconds.time():
+            self._conn = await self._pool.acquire()
+        return _InstrumentedConnection(self._conn)
+
+    def __await__(self):
+        return self._acquire().__await__()
+
+    async def __aenter__(self):
+        return await self._acquire()
+
+    async def __aexit__(self, *exc):
+        await self._pool.release(self._conn)
+
+
+class InstrumentedPool:
+    """Обёртка над asyncpg.Pool: время ожидания соединения и каждого запроса."""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    def acquire(self):
+        return _AcquireContext(self._pool)
+
+    async def release(self, conn):
+        await self._pool.release(conn._conn if isinstance(conn, _InstrumentedConnection) else conn)
+
+
+def watch_pool(pool):
+    Gauge("bot_db_pool_connections", "Соединения в пуле", ("state",),
+          fn=lambda: {("open",): pool.get_size(), ("in_use",): pool.get_size() - pool.get_idle_size(),
+                      ("max",): pool.get_max_size()})
+
+
+# --- ВЫГРУЗКА ---
+def build_app():
+    app = web.Application()
+
+    async def handle(request):
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+    app.router.add_get("/metrics", handle)
+    return app
+
+
+async def start_server(host, port, app=None):
+    runner = web.AppRunner(app or build_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики: http://%s:%s/metrics", host, port)
+    return runner
+
+
+def summary():
+    """Короткая сводка для админского чата: самые медленные хендлеры, БД, GigaChat, Bot API."""
+    lines = ["📈 <b>Метрики</b>"]
+
+    def top(hist, title, limit=5):
+        rows = sorted(hist.values.items(), key=lambda kv: -kv[1][-1])[:limit]
+        if not rows:
+            return
+        lines.append(f"\n<b>{title}</b> (кол-во / p50 / p95, сек):")
+        for key, row in rows:
+            count = sum(row[:-1])
+            label = " ".join(k for k in key if k) or "—"
+            lines.append(f"• {label}: {count} / {hist.quantile(0.5, key):g} / {hist.quantile(0.95, key):g}")
+
+    top(handler_seconds, "Хендлеры")
+    top(db_query_seconds, "Запросы к БД")
+    top(db_acquire_seconds, "Ожидание пула", limit=1)
+    top(ai_request_seconds, "GigaChat")
+    top(api_request_seconds, "Bot API")
+    errors = sum(handler_errors.values.values())
+    retry = sum(api_retry_after.values.values())
+    tokens = ", ".join(f"{k[0]}: {v}" for k, v in ai_tokens.values.items()) or "0"
+    lines.append(f"\n⚠️ Ошибок в хендлерах: {errors}, ответов 429: {retry}\n🔤 Токены GigaChat: {tokens}")
+    return "\n".join(lines)
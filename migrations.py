@@ -0,0 +1,42 @@
+import logging
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Любое число, одинаковое у всех процессов бота: под ним держится advisory lock на время миграций
+LOCK_ID = 0x5C9B07
+
+
+async def migrate(pool, migrations):
+    """Применяет недостающие миграции из списка [(версия, название, [sql, ...]), ...].
+
+    Когда схема актуальна, это один запрос. Иначе миграции идут по
+    порядку в одной транзакции под advisory lock, так что воркеры,
+    стартующие одновременно, не накатят одно и то же дважды.
+    """
+    latest = max(version for version, _, _ in migrations)
+    async with pool.acquire() as conn:
+        if await _current(conn) >= latest:
+            return
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", LOCK_ID)
+            await conn.execute(
+                "CREATE TABLE IF NOT EXISTS schema_migrations (version INT PRIMARY KEY, name TEXT NOT NULL, "
+                "applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+            )
+            current = await _current(conn)
+            for version, name, statements in sorted(migrations, key=lambda m: m[0]):
+                if version <= current:
+                    continue
+                for sql in statements:
+                    await conn.execute(sql)
+                await conn.execute("INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name)
+                logger.info("Миграция %s: %s", version, name)
+
+
+async def _current(conn):
+    try:
+        return await conn.fetchval("SELECT max(version) FROM schema_migrations") or 0
+    except asyncpg.UndefinedTableError:
+        return 0  # первый запуск
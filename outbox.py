@@ -0,0 +1,192 @@
+import asyncio
+import logging
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = "\n\n➖➖➖➖➖➖\n\n"
+
+
+class AdminOutbox:
+    """Уведомления в админский чат через таблицу admin_outbox.
+
+    put() только записывает сообщение в БД — ученик сразу получает ответ,
+    а фоновая задача доставляет записи в чат не быстрее rate сообщений
+    в секунду (для группы Telegram разрешает ~20 в минуту). Пока ждём
+    очереди, новые записи копятся и уходят одним сводным сообщением.
+    Неудачная отправка повторяется с растущей паузой, пока не пройдёт;
+    запись, которую Telegram не принимает даже без разметки, помечается
+    failed. Записи берутся «в аренду» на lease секунд, поэтому несколько
+    процессов бота не отправят одно и то же дважды.
+
+    Очередь общая для всех филиалов: bot_for(branch_id) возвращает бота,
+    от имени которого отправлять, лимиты — на пару (филиал, чат). Записи
+    филиала без админского чата (chat_id = 0) ждут в очереди, пока чат не
+    появится в настройках: тогда assign() отдаёт их этому чату.
+    """
+
+    def __init__(self, bot_for, rate=20 / 60, burst=3, max_batch=10, limit=4096, lease=60, poll_interval=10.0):
+        self.bot_for = bot_for
+        self.rate, self.burst = rate, burst
+        self.max_batch = max_batch
+        self.limit = limit
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.queued = 0  # принято put() этим процессом
+        self.sent = 0  # доставлено записей
+        self.messages = 0  # из них отправлено сообщений (сводки считаются за одно)
+        self.failed = 0
+        self._buckets = {}  # (branch_id, chat_id) -> TokenBucket
+        self._pool = None
+        self._task = None
+        self._wakeup = asyncio.Event()
+
+    def _bucket(self, key):
+        if key not in self._buckets:
+            self._buckets[key] = TokenBucket(self.rate, self.burst)
+        return self._buckets[key]
+
+    async def put(self, pool, branch_id, chat_id, kind, text):
+        async with pool.acquire() as conn:
+            await conn.execute(
+                "INSERT INTO admin_outbox (branch_id, chat_id, kind, text) VALUES ($1, $2, $3, $4)",
+                branch_id, chat_id, kind, text,
+            )
+        self.queued += 1
+        self._wakeup.set()
+
+    async def assign(self, pool, branch_id, chat_id):
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                "UPDATE admin_outbox SET chat_id = $2 WHERE branch_id = $1 AND chat_id = 0 AND status = 'pending' "
+                "RETURNING id",
+                branch_id, chat_id,
+            )
+        if rows:
+            logger.info("Филиал %s: %s уведомлений, ждавших админский чат, уйдут в %s", branch_id, len(rows), chat_id)
+            self._wakeup.set()
+        return len(rows)
+
+    def start(self, pool):
+        self._pool = pool
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Недоставленное остаётся в таблице и уйдёт после перезапуска
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                busy = await self._dispatch()
+            except Exception as e:
+                logger.warning("Не удалось разослать уведомления админам: %s", e)
+                busy = False
+            if not busy:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def _dispatch(self):
+        """Одно сообщение в один чат. False — отправлять пока нечего."""
+        async with self._pool.acquire() as conn:
+            head = await conn.fetchrow(
+                "SELECT branch_id, chat_id FROM admin_outbox WHERE status = 'pending' AND chat_id <> 0 "
+                "AND next_attempt_at <= now() ORDER BY id LIMIT 1"
+            )
+        if head is None:
+            return False
+        key = (head['branch_id'], head['chat_id'])
+        # Пока ждём лимит чата, в очереди копятся новые записи — уйдут одной сводкой
+        await self._bucket(key).acquire()
+
+        async with self._pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT id, text FROM admin_outbox WHERE status = 'pending' AND branch_id = $1 AND chat_id = $2 "
+                "AND next_attempt_at <= now() ORDER BY id LIMIT $3",
+                *key, self.max_batch,
+            )
+            rows = self._pack(rows)
+            claimed = await conn.fetch(
+                "UPDATE admin_outbox SET next_attempt_at = now() + make_interval(secs => $2) "
+                "WHERE id = ANY($1::bigint[]) AND status = 'pending' AND next_attempt_at <= now() RETURNING id",
+                [r['id'] for r in rows], float(self.lease),
+            )
+        claimed = {r['id'] for r in claimed}
+        rows = [r for r in rows if r['id'] in claimed]
+        if not rows:
+            return True
+        await self._send(key, rows)
+        return True
+
+    def _pack(self, rows):
+        """Сколько первых записей помещается в одно сообщение (хотя бы одна)."""
+        packed, size = [], len(self._header(len(rows)))
+        for row in rows:
+            size += len(row['text']) + len(SEPARATOR)
+            if packed and size > self.limit:
+                break
+            packed.append(row)
+        return packed
+
+    @staticmethod
+    def _header(count):
+        return f"📬 <b>Новые обращения: {count}</b>\n\n"
+
+    def _render(self, rows):
+        if len(rows) == 1:
+            return rows[0]['text']
+        return self._header(len(rows)) + SEPARATOR.join(r['text'] for r in rows)
+
+    async def _send(self, key, rows):
+        branch_id, chat_id = key
+        ids = [r['id'] for r in rows]
+        text = self._render(rows)
+        try:
+            bot = self.bot_for(branch_id)
+            if bot is None:
+                raise LookupError(f"филиал {branch_id} не найден")
+            try:
+                await bot.send_message(chat_id, text, parse_mode="HTML")
+            except TelegramBadRequest as e:
+                # Сломанная разметка не должна навсегда застрять в очереди — пробуем простым текстом
+                logger.warning("Админский чат не принял HTML (%s), отправляю без разметки", e)
+                await bot.send_message(chat_id, text)
+        except TelegramRetryAfter as e:
+            self._bucket(key).pause(e.retry_after)
+            await self._mark(ids, "UPDATE admin_outbox SET next_attempt_at = now() WHERE id = ANY($1::bigint[])")
+            return
+        except TelegramBadRequest as e:
+            logger.error("Уведомление админам отброшено (%s записей): %s", len(ids), e)
+            self.failed += len(ids)
+            await self._mark(ids, "UPDATE admin_outbox SET status = 'failed', last_error = $2 WHERE id = ANY($1::bigint[])",
+                             str(e))
+            return
+        except Exception as e:
+            logger.warning("Не удалось отправить уведомление админам, повторю позже: %s", e)
+            await self._mark(
+                ids,
+                "UPDATE admin_outbox SET attempts = attempts + 1, last_error = $2, "
+                "next_attempt_at = now() + make_interval(secs => least(power(2, attempts + 1), 600)) "
+                "WHERE id = ANY($1::bigint[])",
+                str(e),
+            )
+            return
+        self.sent += len(ids)
+        self.messages += 1
+        await self._mark(ids, "UPDATE admin_outbox SET status = 'sent', sent_at = now() WHERE id = ANY($1::bigint[])")
+
+    async def _mark(self, ids, sql, *args):
+        async with self._pool.acquire() as conn:
+            await conn.execute(sql, ids, *args)
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+logger = logging.getLogger(__name__)
+
+
+class StorageTimings:
+    """Сколько раз и как долго ходили в базу за состоянием FSM."""
+
+    def __init__(self):
+        self.ops = {}  # op -> [count, total_seconds, max_seconds]
+
+    def record(self, op, seconds):
+        stat = self.ops.setdefault(op, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += seconds
+        stat[2] = max(stat[2], seconds)
+
+    def snapshot(self):
+        return {op: {"count": c, "avg_ms": t / c * 1000 if c else 0.0, "max_ms": m * 1000}
+                for op, (c, t, m) in self.ops.items()}
+
+
+class PgStorage(BaseStorage):
+    """FSM-хранилище в Postgres поверх общего пула asyncpg.
+
+    Каждое изменение состояния или данных — один upsert. Недавно
+    прочитанные ключи лежат в небольшом LRU; брошенные анкеты удаляются
+    по TTL фоновой задачей.
+    """
+
+    def __init__(self, ttl=86400, cache_size=1000, cache_seconds=300, cleanup_interval=600, slow_ms=200):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.cache_seconds = cache_seconds
+        self.cleanup_interval = cleanup_interval
+        self.slow_ms = slow_ms
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.timings = StorageTimings()
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()  # key -> (state, data, cached_at)
+        self._pool = None
+        self._cleanup_task = None
+
+    async def start(self, pool):
+        self._pool = pool
+        self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+
+    async def _execute(self, op, method, sql, *args):
+        started = time.perf_counter()
+        try:
+            async with self._pool.acquire() as conn:
+                return await getattr(conn, method)(sql, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings.record(op, elapsed)
+            if elapsed * 1000 > self.slow_ms:
+                logger.warning("FSM storage %s: %.0f мс", op, elapsed * 1000)
+
+    # --- LRU ---
+    def _cached(self, key):
+        item = self._cache.get(key)
+        if item is None or time.monotonic() - item[2] > self.cache_seconds:
+            return None
+        self._cache.move_to_end(key)
+        return item
+
+    def _remember(self, key, state, data):
+        if self.cache_seconds <= 0:
+            return
+        self._cache[key] = (state, data, time.monotonic())
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _read(self, key):
+        item = self._cached(key)
+        if item is not None:
+            self.hits += 1
+            return item[0], item[1]
+        self.misses += 1
+        row = await self._execute(
+            "read", "fetchrow",
+            "SELECT state, data FROM fsm_storage WHERE key = $1 AND updated_at > now() - make_interval(secs => $2)",
+            key, float(self.ttl),
+        )
+        state, data = (row['state'], json.loads(row['data'])) if row else (None, {})
+        self._remember(key, state, data)
+        return state, data
+
+    # --- BaseStorage ---
+    async def set_state(self, key, state=None):
+        k = self.key_builder.build(key)
+        state = state.state if isinstance(state, State) else state
+        await self._execute(
+            "set_state", "execute",
+            "INSERT INTO fsm_storage (key, state) VALUES ($1, $2) "
+            "ON CONFLICT (key) DO UPDATE SET state = EXCLUDED.state, updated_at = now(), "
+            # данные просроченной анкеты не должны «воскреснуть» вместе с новым состоянием
+            "data = CASE WHEN fsm_storage.updated_at < now() - make_interval(secs => $3) "
+            "THEN '{}'::jsonb ELSE fsm_storage.data END",
+            k, state, float(self.ttl),
+        )
+        # Другую половину ключа берём только из свежего кэша: устаревшая могла
+        # уже обнулиться в базе по TTL, и мы вернули бы её в кэш как новую
+        item = self._cached(k)
+        if item is not None:
+            self._remember(k, state, item[1])
+        else:
+            self._cache.pop(k, None)
+
+    async def get_state(self, key):
+        state, _ = await self._read(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key, data):
+        k = self.key_builder.build(key)
+        data = dict(data)
+        await self._execute(
+            "set_data", "execute",
+            "INSERT INTO fsm_storage (key, data) VALUES ($1, $2::jsonb) "
+            "ON CONFLICT (key) DO UPDATE SET data = EXCLUDED.data, updated_at = now(), "
+            "state = CASE WHEN fsm_storage.updated_at < now() - make_interval(secs => $3) "
+            "THEN NULL ELSE fsm_storage.state END",
+            k, json.dumps(data, ensure_ascii=False), float(self.ttl),
+        )
+        item = self._cached(k)
+        if item is not None:
+            self._remember(k, item[0], data)
+        else:
+            self._cache.pop(k, None)
+
+    async def get_data(self, key):
+        _, data = await self._read(self.key_builder.build(key))
+        return dict(data)
+
+    async def _cleanup_loop(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                await self._execute(
+                    "cleanup", "execute",
+                    "DELETE FROM fsm_storage WHERE updated_at < now() - make_interval(secs => $1) "
+                    "OR (state IS NULL AND data = '{}'::jsonb)",
+                    float(self.ttl),
+                )
+            except Exception as e:
+                logger.warning("Не удалось почистить FSM storage: %s", e)
+
+    async def close(self):
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            self._cleanup_task = None
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+
+class TokenBucket:
+    """Асинхронное ведро токенов: rate токенов в секунду, запас до capacity."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, amount=1.0):
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    async def acquire(self, amount=1.0):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        # Telegram прислал retry_after — притормаживаем всех, кто берёт токены из этого ведра
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class KeyedInterval:
+    """Минимальный интервал между событиями для одного ключа (например, chat_id)."""
+
+    def __init__(self, interval):
+        self.interval = float(interval)
+        self._next = {}
+
+    async def wait(self, key):
+        now = time.monotonic()
+        ready_at = self._next.get(key, 0.0)
+        self._next[key] = max(now, ready_at) + self.interval
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+        if len(self._next) > 10000:
+            self._cleanup(now)
+
+    def pause(self, key, seconds):
+        self._next[key] = max(self._next.get(key, 0.0), time.monotonic() + seconds)
+
+    def _cleanup(self, now):
+        for key in [k for k, t in self._next.items() if t < now]:
+            del self._next[key]
+
+
+class GroupRetryAfter(BaseRequestMiddleware):
+    """Повторяет запросы в группы (chat_id < 0), на которые Telegram ответил 429.
+
+    В группе лимит ~20 сообщений в минуту, и его легко выбрать подсказками
+    админке, прогрессом рассылок и уведомлениями. Хендлер, у которого не
+    ушёл ответ, падает до смены состояния, и диалог админа застревает, —
+    поэтому ждём, сколько просит Telegram, если это не дольше max_wait
+    секунд. Личные чаты не трогаем: рассылки и стриминг ответов
+    обрабатывают 429 сами.
+    """
+
+    def __init__(self, max_wait=30.0, max_retries=3):
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if not isinstance(chat_id, int) or chat_id >= 0:
+            return await make_request(bot, method)
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries or e.retry_after > self.max_wait:
+                    raise
+                await asyncio.sleep(e.retry_after)
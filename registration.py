@@ -0,0 +1,135 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+UPSERT_SQL = (
+    "INSERT INTO users (branch_id, user_id, username) VALUES ($1, $2, $3) "
+    "ON CONFLICT (branch_id, user_id) DO UPDATE SET username = EXCLUDED.username, status = 'active', last_error_at = NULL"
+)
+ACTIVE = "active"
+STATUS_SQL = "UPDATE users SET status = $3, last_error_at = now() WHERE branch_id = $1 AND user_id = $2"
+
+
+class UserRegistry:
+    """Регистрация пользователей филиала без ожидания базы.
+
+    Известные user_id (с их username) держим в памяти, новых и сменивших
+    username складываем в буфер и пишем в users пачкой — по размеру буфера,
+    по таймеру и при остановке бота.
+
+    Так же пачкой пишется статус доставки: кто заблокировал бота
+    (blocked) или удалил аккаунт (deactivated). Рассылки таких пропускают,
+    а /start от пользователя снова делает его активным.
+    """
+
+    def __init__(self, branch, batch_size=200, flush_interval=5.0):
+        self.branch = branch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._known = {}  # user_id -> username
+        self._pending = {}
+        self._statuses = {}  # user_id -> новый статус, ещё не записанный в БД
+        self._inactive = set()
+        self._pool = None
+        self._task = None
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._known)
+
+    @property
+    def inactive(self):
+        return len(self._inactive)
+
+    async def start(self, pool):
+        self._pool = pool
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("SELECT user_id, username, status FROM users WHERE branch_id = $1", self.branch)
+        self._known = {r['user_id']: r['username'] for r in rows}
+        self._inactive = {r['user_id'] for r in rows if r['status'] != ACTIVE}
+        logger.info("Филиал %s: загружено пользователей %s, недоступных для рассылки %s",
+                    self.branch, len(self._known), len(self._inactive))
+        self._task = asyncio.create_task(self._run())
+
+    def register(self, user_id, username):
+        if user_id in self._known and self._known[user_id] == username and user_id not in self._inactive:
+            return
+        self._known[user_id] = username
+        self._inactive.discard(user_id)
+        self._statuses.pop(user_id, None)
+        self._pending[user_id] = username
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def mark(self, user_id, status):
+        """Рассылка не дошла навсегда: status — blocked или deactivated."""
+        self._inactive.add(user_id)
+        self._statuses[user_id] = status
+        if len(self._statuses) >= self.batch_size:
+            self._wakeup.set()
+
+    async def count_active(self):
+        async with self._pool.acquire() as conn:
+            return await conn.fetchval("SELECT count(*) FROM users WHERE branch_id = $1 AND status = 'active'", self.branch)
+
+    async def recipients(self, batch_size=1000):
+        """user_id активных пользователей пачками (keyset по user_id), весь список в памяти не держим."""
+        last = 0
+        while True:
+            async with self._pool.acquire() as conn:
+                rows = await conn.fetch(
+                    "SELECT user_id FROM users WHERE branch_id = $1 AND status = 'active' AND user_id > $2 "
+                    "ORDER BY user_id LIMIT $3",
+                    self.branch, last, batch_size,
+                )
+            for row in rows:
+                if row['user_id'] not in self._inactive:
+                    yield row['user_id']
+            if len(rows) < batch_size:
+                return
+            last = rows[-1]['user_id']
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning("Не удалось сохранить пользователей, повторю позже: %s", e)
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not (self._pending or self._statuses) or self._pool is None:
+                return
+            batch, self._pending = self._pending, {}
+            statuses, self._statuses = self._statuses, {}
+            try:
+                async with self._pool.acquire() as conn:
+                    if batch:
+                        await conn.executemany(UPSERT_SQL, [(self.branch, *item) for item in batch.items()])
+                    if statuses:
+                        await conn.executemany(STATUS_SQL, [(self.branch, *item) for item in statuses.items()])
+            except Exception:
+                # Возвращаем в буфер, более свежие данные из буфера не затираем
+                for user_id, username in batch.items():
+                    self._pending.setdefault(user_id, username)
+                for user_id, status in statuses.items():
+                    if user_id in self._inactive:
+                        self._statuses.setdefault(user_id, status)
+                raise
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
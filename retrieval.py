@@ -0,0 +1,255 @@
+import math
+import re
+from collections import Counter
+
+# --- НОРМАЛИЗАЦИЯ ТЕКСТА (стеммер Портера для русского языка) ---
+_PERFECTIVE = re.compile(r"((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$")
+_REFLEXIVE = re.compile(r"(с[яь])$")
+_ADJECTIVE = re.compile(r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$")
+_PARTICIPLE = re.compile(r"((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$")
+_VERB = re.compile(
+    r"((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)"
+    r"|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$"
+)
+_NOUN = re.compile(
+    r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$"
+)
+_DERIVATIONAL = re.compile(r".*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$")
+_RV = re.compile(r"^(.*?[аеиоуыэюя])(.*)$")
+_WORD = re.compile(r"[a-zа-я0-9]+")
+
+STOP_WORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было вот от
+меня еще нет о из ему теперь когда даже ну ли если уже или ни быть был него до вас нибудь опять уж вам ведь
+там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без будто чего раз
+тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом один почти мой тем чтобы
+нее сейчас были куда зачем всех никогда можно при наконец два об другой хоть после над больше тот через эти
+нас про всего них какая много разве три эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя
+такой им более всегда конечно всю между это наш наши
+""".split())
+
+
+def stem(word):
+    m = _RV.match(word)
+    if not m:
+        return word
+    pre, rv = m.groups()
+    temp = _PERFECTIVE.sub("", rv, 1)
+    if temp == rv:
+        rv = _REFLEXIVE.sub("", rv, 1)
+        temp = _ADJECTIVE.sub("", rv, 1)
+        if temp != rv:
+            rv = _PARTICIPLE.sub("", temp, 1)
+        else:
+            temp = _VERB.sub("", rv, 1)
+            rv = _NOUN.sub("", rv, 1) if temp == rv else temp
+    else:
+        rv = temp
+    rv = re.sub("и$", "", rv, 1)
+    if _DERIVATIONAL.match(rv):
+        rv = re.sub("ость?$", "", rv, 1)
+    temp = re.sub("ь$", "", rv, 1)
+    if temp == rv:
+        rv = re.sub("ейше?$", "", rv, 1)
+        rv = re.sub("нн$", "н", rv, 1)
+    else:
+        rv = temp
+    return pre + rv
+
+
+def tokenize(text, stop_words=STOP_WORDS):
+    """Нижний регистр, ё -> е, без стоп-слов, по основам слов."""
+    words = _WORD.findall(text.lower().replace("ё", "е"))
+    return [stem(w) for w in words if w not in stop_words]
+
+
+def estimate_tokens(text):
+    # Для русского текста у GigaChat выходит примерно 3 символа на токен
+    return len(text) // 3 + 1
+
+
+# --- ИНДЕКС ---
+class BM25Index:
+    """Лексический индекс BM25 с добавлением и удалением документов по одному."""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs = {}  # doc_id -> (text, length)
+        self.postings = {}  # term -> {doc_id: tf}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, doc_id, text):
+        if doc_id in self.docs:
+            self.remove(doc_id)
+        counts = Counter(tokenize(text))
+        length = sum(counts.values())
+        self.docs[doc_id] = (text, length)
+        self.total_length += length
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, doc_id):
+        text, length = self.docs.pop(doc_id)
+        self.total_length -= length
+        for term in set(tokenize(text)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+
+    def search(self, query, k=10):
+        if not self.docs:
+            return []
+        n = len(self.docs)
+        avg_len = self.total_length / n or 1
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                length = self.docs[doc_id][1]
+                norm = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_len))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * norm
+        return sorted(((s, d) for d, s in scores.items()), reverse=True)[:k]
+
+
+# --- ЧАНКИ ---
+def split_base_prompt(base_prompt):
+    """Делит базу знаний на постоянную часть (роль, заголовки блоков) и пункты-факты.
+
+    Пункт начинается с «- », строки с отступом относятся к предыдущему пункту.
+    """
+    header, facts = [], []
+    block = ""
+    for line in base_prompt.strip().splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.startswith("БЛОК"):
+            block = stripped
+            header.append("\n" + stripped)
+        elif stripped.startswith("- "):
+            facts.append([block, stripped])
+        elif line.startswith(" ") and facts:
+            facts[-1][1] += " " + stripped
+        else:
+            header.append(stripped)
+    return "\n".join(header), [(block, text) for block, text in facts]
+
+
+def split_text(text, size=500):
+    """Режет длинный текст по абзацам на куски примерно по size символов."""
+    parts, current = [], ""
+    for para in re.split(r"\n\s*\n|\n", text or ""):
+        para = para.strip()
+        if not para:
+            continue
+        if current and len(current) + len(para) > size:
+            parts.append(current)
+            current = ""
+        current = f"{current}\n{para}" if current else para
+    if current:
+        parts.append(current)
+    return parts or [""]
+
+
+EVENTS_HEADER = "ВАЖНО: НИЖЕ СПИСОК МЕРОПРИЯТИЙ, КОТОРЫЕ ИДУТ В ШКОЛЕ ПРЯМО СЕЙЧАС (ИЗ БАЗЫ ДАННЫХ):"
+EVENTS_FOOTER = "Если ученик спрашивает 'что у нас будет', смотри в этот список. Если там нет — отвечай, что пока мероприятий не запланировано."
+NO_EVENTS = "В списке актуальных мероприятий школы сейчас пусто."
+
+
+def stuff_prompt(base_prompt, events):
+    """Прежний способ: вся база знаний и все мероприятия целиком."""
+    events_str = "\n".join([f"- {e['short_text']}: {e['long_text']}" for e in events]) if events else NO_EVENTS
+    return base_prompt + f"\n\n{EVENTS_HEADER}\n{events_str}\n\n{EVENTS_FOOTER}"
+
+
+class KnowledgeBase:
+    """Собирает системный промпт только из кусков, относящихся к вопросу.
+
+    Пункты базы знаний индексируются один раз, мероприятия — по мере
+    изменения (добавляются и удаляются по одному). В промпт попадают
+    top_k лучших кусков, пока хватает token_budget. Если подходящих
+    мероприятий не нашлось, остаток бюджета занимают заголовки свежих.
+    """
+
+    def __init__(self, base_prompt, top_k=8, token_budget=1200):
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.header, facts = split_base_prompt(base_prompt)
+        self.index = BM25Index()
+        self.chunks = {}  # doc_id -> текст для промпта (пункты базы уже начинаются с «- »)
+        for i, (block, text) in enumerate(facts):
+            doc_id = f"kb:{i}"
+            self.chunks[doc_id] = text
+            # Заголовок блока индексируем вместе с пунктом: «в школе», «Движение» и т.п.
+            self.index.add(doc_id, f"{block}\n{text}")
+        self._events = {}  # event_id -> (short_text, long_text, [doc_id, ...])
+        self._events_version = None
+
+    def sync_events(self, events, version=None):
+        """Приводит индекс к текущему списку мероприятий, трогая только изменившиеся."""
+        if version is not None and version == self._events_version:
+            return
+        seen = set()
+        for e in events:
+            seen.add(e['id'])
+            current = self._events.get(e['id'])
+            if current and current[0] == e['short_text'] and current[1] == e['long_text']:
+                continue
+            if current:
+                self._drop_event(e['id'])
+            doc_ids = []
+            for n, part in enumerate(split_text(e['long_text'])):
+                doc_id = f"ev:{e['id']}:{n}"
+                text = f"{e['short_text']}: {part}" if part else e['short_text']
+                self.chunks[doc_id] = text
+                self.index.add(doc_id, text)
+                doc_ids.append(doc_id)
+            self._events[e['id']] = (e['short_text'], e['long_text'], doc_ids)
+        for event_id in [i for i in self._events if i not in seen]:
+            self._drop_event(event_id)
+        self._events_version = version
+
+    def _drop_event(self, event_id):
+        for doc_id in self._events.pop(event_id)[2]:
+            self.index.remove(doc_id)
+            del self.chunks[doc_id]
+
+    def build_prompt(self, question, events, version=None):
+        self.sync_events(events, version)
+        budget = self.token_budget
+        facts, event_parts = [], []
+        for _, doc_id in self.index.search(question, k=self.top_k):
+            text = self.chunks[doc_id]
+            cost = estimate_tokens(text)
+            if cost > budget:
+                continue
+            budget -= cost
+            if doc_id.startswith("ev:"):
+                event_parts.append(f"- {text}")
+            else:
+                facts.append(text)
+
+        if not event_parts:
+            # По вопросу ничего не нашлось — даём хотя бы названия свежих мероприятий
+            for e in events:
+                line = f"- {e['short_text']}"
+                cost = estimate_tokens(line)
+                if cost > budget:
+                    break
+                budget -= cost
+                event_parts.append(line)
+
+        prompt = self.header
+        if facts:
+            prompt += "\n\nСПРАВКА ПО ВОПРОСУ (из базы знаний):\n" + "\n".join(facts)
+        events_str = "\n".join(event_parts) if events else NO_EVENTS
+        return prompt + f"\n\n{EVENTS_HEADER}\n{events_str}\n\n{EVENTS_FOOTER}"
@@ -0,0 +1,77 @@
+import logging
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InputMediaPhoto, Message
+
+logger = logging.getLogger(__name__)
+
+
+def _not_modified(e):
+    return "message is not modified" in str(e)
+
+
+class ScreenRenderer:
+    """Переход между экранами меню правкой текущего сообщения.
+
+    Текст правим через edit_text, фото — через edit_media (подпись и
+    клавиатура меняются тем же вызовом). Удаляем и отправляем заново только
+    когда меняется тип сообщения: был текст, а нужно фото, или наоборот.
+    """
+
+    def __init__(self, media):
+        self.media = media
+
+    async def show(self, callback, pool, text, reply_markup=None, photo=None, photo_id=None,
+                   parse_mode="HTML", disable_web_page_preview=None):
+        """photo — путь к статичной картинке (через MediaRegistry), photo_id — file_id из Telegram."""
+        try:
+            await callback.answer()
+        except Exception:
+            pass
+
+        if photo:
+            try:
+                await self.media.content_hash(photo)
+            except OSError:
+                # Картинки нет на диске — показываем экран без неё
+                photo = None
+
+        msg = callback.message
+        editable = isinstance(msg, Message)
+        want_photo = bool(photo or photo_id)
+        if editable and bool(msg.photo) == want_photo:
+            try:
+                if want_photo:
+                    await self._edit_photo(msg, pool, text, photo, photo_id, parse_mode, reply_markup)
+                else:
+                    await msg.edit_text(text, parse_mode=parse_mode, reply_markup=reply_markup,
+                                        disable_web_page_preview=disable_web_page_preview)
+                return
+            except TelegramBadRequest as e:
+                if _not_modified(e):
+                    return
+                logger.info("Не удалось отредактировать экран, отправляю заново: %s", e)
+
+        try:
+            await msg.delete()
+        except Exception:
+            pass
+        if photo:
+            await self.media.send(pool, msg.answer_photo, photo, caption=text, parse_mode=parse_mode, reply_markup=reply_markup)
+        elif photo_id:
+            await msg.answer_photo(photo_id, caption=text, parse_mode=parse_mode, reply_markup=reply_markup)
+        else:
+            await msg.answer(text, parse_mode=parse_mode, reply_markup=reply_markup,
+                             disable_web_page_preview=disable_web_page_preview)
+
+    async def _edit_photo(self, msg, pool, text, photo, photo_id, parse_mode, reply_markup):
+        async def edit(media):
+            return await msg.edit_media(
+                InputMediaPhoto(media=media, caption=text, parse_mode=parse_mode),
+                reply_markup=reply_markup,
+            )
+
+        if photo:
+            await self.media.send(pool, edit, photo)
+        else:
+            await edit(photo_id)
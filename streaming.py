@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+
+
+def _cut_point(text, limit):
+    # Режем по переводу строки или пробелу, чтобы не рвать слова
+    for sep in ("\n", " "):
+        pos = text.rfind(sep, limit // 2, limit)
+        if pos != -1:
+            return pos + 1
+    return limit
+
+
+class ProgressiveReply:
+    """Постепенно дописывает ответ в сообщение «Думаю...».
+
+    Правки склеиваются: не чаще раза в interval секунд и не меньше
+    min_chars новых символов. Если текст не влезает в одно сообщение,
+    продолжение уходит следующими сообщениями.
+    """
+
+    def __init__(self, message, interval=1.0, min_chars=60, limit=MESSAGE_LIMIT):
+        self.anchor = message
+        self.message = message
+        self.interval = interval
+        self.min_chars = min_chars
+        self.limit = limit
+        self.text = ""  # текст текущего сообщения
+        self.shown = ""  # что из него уже видит пользователь
+        self.next_edit_at = 0.0
+
+    async def feed(self, chunk):
+        self.text += chunk
+        while len(self.text) > self.limit:
+            cut = _cut_point(self.text, self.limit)
+            head, self.text = self.text[:cut].rstrip(), self.text[cut:].lstrip()
+            await self._flush(head, force=True)
+            # Следующая часть пойдёт новым сообщением, как только в ней появится текст
+            self.message = None
+            self.shown = ""
+        if time.monotonic() >= self.next_edit_at and len(self.text) - len(self.shown) >= self.min_chars:
+            await self._flush(self.text)
+
+    async def finish(self):
+        if self.text and self.text != self.shown:
+            await self._flush(self.text, force=True)
+
+    async def _flush(self, text, force=False):
+        if not text.strip():
+            return
+        try:
+            if self.message is None:
+                self.message = await self.anchor.answer(text)
+            else:
+                await self.message.edit_text(text)
+            self.shown = text
+        except TelegramRetryAfter as e:
+            if not force:
+                self.next_edit_at = time.monotonic() + e.retry_after
+                return
+            await asyncio.sleep(e.retry_after)
+            await self._flush(text, force=True)
+            return
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+            self.shown = text
+        self.next_edit_at = time.monotonic() + self.interval
+
+
+async def send_long(message, text, limit=MESSAGE_LIMIT):
+    """Отправляет готовый текст ответом на message, разбивая на части по limit символов."""
+    while len(text) > limit:
+        cut = _cut_point(text, limit)
+        await message.answer(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        await message.answer(text)
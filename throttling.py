@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+TOO_FAST = "⏳ Слишком часто! Подожди немного и попробуй снова."
+AI_BUSY = "🤖 Сейчас очень много вопросов, я не успеваю. Спроси чуть позже, пожалуйста."
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Лимиты на пользователя и на весь бот.
+
+    Обычные хендлеры (меню, анкеты) и дорогие — помеченные флагом
+    rate="ai" — расходуют разные вёдра токенов. Если пользователь задаёт
+    новый вопрос, пока нейросеть отвечает на предыдущий, старый запрос
+    отменяется. О превышении лимита пишем один раз, дальше молча
+    пропускаем до первого разрешённого запроса. Апдейты, накопившиеся
+    за время перезапуска (backlog=True), лимитами не режутся: их отправили
+    не подряд, а просто доставили разом.
+    """
+
+    def __init__(self, rate=2.0, burst=5, ai_rate=0.1, ai_burst=3, global_ai_rate=2.0, global_ai_burst=10,
+                 max_users=10000):
+        self.rate, self.burst = rate, burst
+        self.ai_rate, self.ai_burst = ai_rate, ai_burst
+        self.global_ai = TokenBucket(global_ai_rate, global_ai_burst)
+        self.max_users = max_users
+        self.rejected = 0
+        self.superseded = 0
+        self._buckets = {}  # user_id -> {"default": TokenBucket, "ai": TokenBucket}
+        self._notified = set()
+        self._inflight = {}  # user_id -> задача с текущим AI-запросом
+
+    def _bucket(self, user_id, kind):
+        buckets = self._buckets.get(user_id)
+        if buckets is None:
+            if len(self._buckets) >= self.max_users:
+                self._prune()
+            buckets = self._buckets[user_id] = {}
+        if kind not in buckets:
+            if kind == "ai":
+                buckets[kind] = TokenBucket(self.ai_rate, self.ai_burst)
+            else:
+                buckets[kind] = TokenBucket(self.rate, self.burst)
+        return buckets[kind]
+
+    def _prune(self):
+        # Выкидываем тех, чьи вёдра уже полные: они давно ничего не присылали
+        now = time.monotonic()
+        for user_id in list(self._buckets):
+            full = all(min(b.capacity, b.tokens + (now - b.updated) * b.rate) >= b.capacity
+                       for b in self._buckets[user_id].values())
+            if full:
+                del self._buckets[user_id]
+                self._notified.discard(user_id)
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or data.get("backlog"):
+            return await handler(event, data)
+        kind = get_flag(data, "rate", default="default")
+
+        if not self._bucket(user.id, kind).try_acquire():
+            return await self._reject(event, user.id, TOO_FAST)
+        if kind == "ai" and not self.global_ai.try_acquire():
+            return await self._reject(event, user.id, AI_BUSY)
+        self._notified.discard(user.id)
+
+        if kind != "ai":
+            return await handler(event, data)
+
+        previous = self._inflight.get(user.id)
+        if previous is not None and not previous.done():
+            self.superseded += 1
+            previous.cancel()
+        task = asyncio.current_task()
+        self._inflight[user.id] = task
+        try:
+            return await handler(event, data)
+        finally:
+            if self._inflight.get(user.id) is task:
+                del self._inflight[user.id]
+
+    async def _reject(self, event, user_id, text):
+        self.rejected += 1
+        first = user_id not in self._notified
+        self._notified.add(user_id)
+        try:
+            if isinstance(event, CallbackQuery):
+                # На callback всё равно нужно ответить, иначе у кнопки крутятся часики
+                await event.answer(text if first else None)
+            elif isinstance(event, Message) and first:
+                await event.answer(text)
+        except Exception as e:
+            logger.debug("Не удалось предупредить о лимите: %s", e)
+        return None
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import multiprocessing
+import secrets
+import signal
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import BaseRequestHandler
+
+logger = logging.getLogger(__name__)
+
+
+class BotsRequestHandler(BaseRequestHandler):
+    """Апдейты для нескольких заранее созданных ботов: бот выбирается по id в адресе {path}/{bot_id}.
+
+    Сессию ботов здесь не закрываем: она общая и нужна хендлерам, которые
+    ещё доделываются после остановки сервера.
+    """
+
+    def __init__(self, dispatcher, bots, secret_token=None, **data):
+        super().__init__(dispatcher=dispatcher, handle_in_background=True, **data)
+        self.bots = {bot.id: bot for bot in bots}
+        self.secret_token = secret_token
+
+    def verify_secret(self, telegram_secret_token, bot):
+        # Без секрета адрес вебхука — единственная защита, такие запросы не принимаем.
+        # Байты, а не строки: compare_digest падает на заголовке не из ASCII
+        if not self.secret_token or telegram_secret_token is None:
+            return False
+        return secrets.compare_digest(telegram_secret_token.encode(), self.secret_token.encode())
+
+    async def resolve_bot(self, request):
+        bot_id = request.match_info.get("bot_id")
+        if bot_id is None and len(self.bots) == 1:
+            return next(iter(self.bots.values()))
+        bot = self.bots.get(int(bot_id)) if bot_id and bot_id.isdigit() else None
+        if bot is None:
+            raise web.HTTPNotFound()
+        return bot
+
+    async def close(self):
+        pass
+
+
+def build_app(dp, bots, path, secret_token):
+    """aiohttp-приложение, которое принимает апдейты от Telegram и проверяет секретный токен.
+
+    Один бот слушает path, как раньше; у каждого — ещё и path/<id бота>.
+    Без секретного токена приложение не собирается.
+    """
+    if not secret_token:
+        raise ValueError("Для webhook нужен секретный токен (WEBHOOK_SECRET)")
+    app = web.Application()
+    handler = BotsRequestHandler(dp, bots, secret_token=secret_token)
+    handler.register(app, path=f"{path.rstrip('/')}/{{bot_id}}")
+    if len(handler.bots) == 1:
+        handler.register(app, path=path)
+    return app
+
+
+async def serve(app, host, port, reuse_port=False):
+    """Поднимает HTTP-сервер и работает, пока процесс не попросят остановиться."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, reuse_port=reuse_port)
+    await site.start()
+    logger.info("Webhook слушает %s:%s", host, port)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+def run_workers(target, workers):
+    """Запускает target(index) в workers процессах (SO_REUSEPORT делит между ними один порт).
+
+    На унаследованное от родителя состояние target полагаться не должен: при
+    spawn/forkserver воркер получает только index, а настройки читает из окружения.
+    """
+    if workers <= 1:
+        target(0)
+        return
+    processes = [multiprocessing.Process(target=target, args=(i,), name=f"webhook-worker-{i}") for i in range(workers)]
+    for p in processes:
+        p.start()
+
+    def forward(signum, frame):
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for p in processes:
+        p.join()